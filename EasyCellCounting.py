@@ -2,905 +2,481 @@
 # coding: utf-8
 
 # # EasyCellCounting.py
-# 
-# This program iterates through flourescent cell images and counts cells on the left and right side of selected regions of interest. While this program was initially created for Tomato fluorescing neurons in the spinal cord and brain, EasyCellCounting.py can be used for any images that require efficient, easy counting of flourescent cells.  
+#
+# This program iterates through flourescent cell images and counts cells on the left and right side of selected regions of interest. While this program was initially created for Tomato fluorescing neurons in the spinal cord and brain, EasyCellCounting.py can be used for any images that require efficient, easy counting of flourescent cells.
+#
+# EasyCellCounting.py is the command line entry point. The counting itself lives in the cellcount package, which can be imported (for example by worker processes) without listing folders, opening Excel files or starting the OpenCV windows:
+#
+#     python EasyCellCounting.py "Pics" "Pics (lower)" --input input.xlsx --output cell_counts.xlsx
+#
 # <a id="0"></a> <br>
-# ## Table of Contents  
-# 1. [Packages used by EasyCellCounting.py](#1)     
-# 1. [Useful Functions: the Rotation and InsertionSort Functions](#2) 
-# 1. [Creating two lists to store big TIFF images and the smaller, resized images](#3) 
-#     1. [Activating an emtpy Excel file called "Input.xlsx" to use later and instantiating needed arrays](#4) 
-#     1. [Array Instantiation and Definitions](#5) 
-# 1. [Iterating through small images for user input](#6)     
-# 1. [Iterating and Counting through Large TIFF Files Autonomously](#7)     
+# ## Table of Contents
+# 1. [Packages used by EasyCellCounting.py](#1)
+# 1. [Creating two lists to store big TIFF images and the smaller, resized images](#3)
+# 1. [Iterating through small images for user input](#6)
+# 1. [Iterating and Counting through Large TIFF Files Autonomously](#7)
 # 1. [Add counts to a blank Excel file and color code the data](#8)
-#     1. [Color Code Definition](#9) 
+# 1. [Command line](#9)
 
 # <a id="1"></a> <br>
 # ## Packages used by EasyCellCounting.py:
-# 
-# These python packages are required for EasyCellCounting.py to work:
-
-# In[1]:
-
+#
+# These python packages are required for EasyCellCounting.py to work (openpyxl is only loaded when the Excel file is written):
 
 # Used to link folders and files to code
-from os import listdir
-from os.path import isfile, join
-
-
-# Used to create arrays and perform mathematical operations
-import numpy as np
-import pandas as pd
+import argparse
+import re
+from os.path import join
 
 #Packages used to edit and view images:
 import cv2
-import PIL
-from PIL import Image
-
-#Packages used to open and edit Excel Files
-from openpyxl import load_workbook
-from openpyxl.styles import Font
-import openpyxl
-from openpyxl.styles import PatternFill
-from openpyxl.styles.colors import Color
-
-
-# <a id="2"></a> <br>
-# ## Useful Functions: the Rotation and InsertionSort Functions
-# 
-# These functions are used frequently throughout the rest of the code.
-
-# In[2]:
-
-
-# This function rotates an image given an angle and an input image
-def rotate_image(image, angle):
-    Center = tuple(np.array(image.shape[1::-1]) / 2)
-    Matrix = cv2.getRotationMatrix2D(Center, angle, 1.0)
-    # Utilizes openCV rotation Matrix function to rotate images 
-    rotated_image = cv2.warpAffine(image, Matrix, image.shape[1::-1], flags=cv2.INTER_LINEAR)
-    return rotated_image
-        
-
-# The insertionSort function performs insertion sort to organize files in sequential (ascending) order
-
-def insertionSort(arr1, arr2):
-     
-    if (n := len(arr1)) <= 1:
-        return
-    
-    for i in range(1, n):
-         
-        key1 = arr1[i]
-        key2 = arr2[i]
-        m = i-1
-        while m >=0 and key1 < arr1[m] :
-                arr1[m+1] = arr1[m]
-                arr2[m+1] = arr2[m]
-                m -= 1
-        arr1[m+1] = key1
-        arr2[m+1] = key2
-        # Sorts through each file one-by-one by looking at the NAMES of each file.
-        # The "<" operation forces the program to look for the first different character in the names of the file.
-        # One can use this fact to name all files the same format except for certain numbers (to demarcate order)
-        # For example, when comparing "Zymo6 3730.4 1-12_s1.tif" and "Zymo6 3730.4 1-12_s2.tif", the program will place "Zymo6 3730.4 1-12_s1.tif" first in the onlyfiles array.
-        # This is due to naming of "s1" (in this case, "s1" means sample #1).
-        
-
-
-# <a id="4"></a> <br>
-# ## Creating two lists to store big TIFF images and the smaller, resized images
-# 
-# The program also checks to see if each large TIFF file has its corresponding smaller image 
-# 
-# 
-
-# <a id="4"></a> <br>
-# ## Activating an emtpy Excel file called "Input.xlsx" to use later and instantiating needed arrays
-# 
-# EasyCellCounting.py will insert all data into this blank excel file:
-
-# In[3]:
-
-
-#Creating list "r_images" for large TIFF files
-r_mypath= "/Users/amav/Documents/My Programs :)/Pics"
-r_onlyfiles = [ f for f in listdir(r_mypath) if isfile(join(r_mypath,f)) ]
-r_files = [ f for f in listdir(r_mypath) if isfile(join(r_mypath,f)) ]
-
-for i in range(0, len(r_files)):
-    r_files[i] = r_onlyfiles[i]
-insertionSort(r_files, r_onlyfiles)
-r_images = np.empty(len(r_onlyfiles), dtype=object)
-
-for i in range(0, len(r_onlyfiles)):
-    print(r_onlyfiles[i])
-
-
-#Creating list "images" for smaller files
-mypath= "/Users/amav/Documents/My Programs :)/Pics (lower)"
-onlyfiles = [ f for f in listdir(mypath) if isfile(join(mypath,f)) ]
-files = [ f for f in listdir(mypath) if isfile(join(mypath,f)) ]
-
-for i in range(0, len(files)):
-    files[i] = onlyfiles[i]
-
-insertionSort(files, onlyfiles)
-images = np.empty(len(onlyfiles), dtype=object)
 
+# The counting core:
+from cellcount.annotations import DEFAULT_ROI, Annotation, AnnotationStore, Channel
+from cellcount.counting import MAX_AREA, contrast_filter
+from cellcount.files import list_images
+from cellcount.images import (CHANNELS, PROJECTIONS, channel_names, load_roi, native_brightness, probe_image,
+                              rotate_image, to_bgr8)
+from cellcount.viewer import VIEW_SIZE, TiledImage, pan_zoom_roi
 
-for i in range(0, len(files)):
-    if r_onlyfiles[i] not in files:
-        print(files[i])
 
-#Making sure the big TIFF list is the same size as the small images list because each reduced, small image needs to have its corresponding big TIFF image. 
-assert len(r_images) == len(images)
-
-
-# In[4]:
-
-
-# Activate blank Excel file: 
-test_file = "input.xlsx"
-obj = openpyxl.load_workbook(test_file)
-sheet = obj.active
-
-
-# <a id="5"></a> <br>
-# ### These arrays will store final images and counts to display to user and insert into activated excel file respectively. 
-# 
-# The "finished" array will store selected region of interests with counted cells higlighted in green (and blue for identified clusters). The "final_count" array will store the names of each image that is counted.
-
-# In[5]:
-
-
-finished = []
-final_count = []
-
-
-# ### These arrays will store data used in the program
-# 
-# For example, these arrays store the position of selected boxes, user inputed / default brighness levels, and user inputed minimum area / default minimum area of neuron (these inputs are optional to the user).
+# <a id="3"></a> <br>
+# ## Creating two lists to store big TIFF images and the smaller, resized images
+#
+# The program also checks to see if each large TIFF file has its corresponding smaller image. Files are sorted by name (see cellcount/files.py), so name all files the same format except for certain numbers to demarcate order.
 
-# In[6]:
+def load_file_lists(r_mypath, mypath):
+    #Creating list for large TIFF files
+    r_onlyfiles = list_images(r_mypath)
 
+    for i in range(0, len(r_onlyfiles)):
+        print(r_onlyfiles[i])
 
-# Minimum area to classify as a neuron / cell array: 
-min_area_list = []
-cluster_max = []
+    #Creating list for smaller files
+    onlyfiles = list_images(mypath)
 
-# These arrays will store the left and right counts for each image respectively:
-left_count = []
-right_count = []
+    for i in range(0, len(onlyfiles)):
+        if r_onlyfiles[i] not in onlyfiles:
+            print(onlyfiles[i])
 
-# These arrays will help store the final locations of the selected regions of interest
-xpos1 = []
-xpos2 = []
-ypos1 = []
-ypos2 = []
+    #Making sure the big TIFF list is the same size as the small images list because each reduced, small image needs to have its corresponding big TIFF image.
+    assert len(r_onlyfiles) == len(onlyfiles)
 
-# This array will store the brightness index for each image (defaulting to 190)
-bright = []
+    return r_onlyfiles, onlyfiles
 
 
 # <a id="6"></a> <br>
 # # Iterating through small images for user input
-# 
+#
 # ### Here are the user input options below:
-# 
-# 
+#
+#
 # Press "T" to select box and press space to confirm box
-# 
+#
 # Press "U" as many times as needed to move backwards (and redo images)
-# 
+#
+# Press "R" to undo a "U" (the box of that image is restored and the program moves forward again)
+#
 # Press "W, "E", or "O" to rotate counterclockwise, clockwise, or a full 180 degrees respectively
-# 
-# 
+#
+#
+# Press "N" to select an extra, named region of interest on the same image (for example a second region of the section); it is counted from the same decode of the large TIFF file. Rotate the image first: once an extra region of interest is selected, the rotation keys are ignored. Finish the image with one of the other keys as usual, which selects its main region of interest.
+#
 # Press "M" to break loop
-# 
+#
 # Press "Q" to check for the green (you'll need to enter the desired brightness value to check)
-# 
+# (to settle the brightness, minimum / maximum area and cluster settings for a new stain, save the boxes with --save-annotations and run python -m cellcount.calibration on a sample of images instead)
+#
 # Press "V" to use 200 for the brightness threshold
-# 
+#
+# Brightness values are in the units of the large TIFF file: 0 - 255 for 8-bit images and 0 - 65535 for 16-bit images (12-bit cameras usually store 0 - 4095 in a 16-bit file). The "T", "V" and "P" presets are 8-bit values and are scaled up for 16-bit images (160 becomes 40960). The images are counted at their full bit depth and only converted to 8-bit for display.
+#
+# Press "A" to use the automatic threshold instead of a brightness value: the uneven background of the section is estimated and subtracted, and the threshold is picked for the selected box (Otsu's method). This works for most sections with uneven illumination without any brightness tuning.
+#
+# With --viewer the smaller images are not needed: each large TIFF file is shown through the tiled pan / zoom viewer (cellcount/viewer.py), which only reads the parts of the file on screen. Boxes are then drawn on the large TIFF itself: drag with the left mouse button to draw the box, zoom with the mouse wheel or "+" / "-", pan with the right mouse button or "I", "J", "K", "L", and press space to confirm (or "C" to cancel).
+#
 # #### The user must iterate through every small image. (EX: 100 images takes approximately 3 minutes)
+#
+# One Annotation (cellcount/annotations.py) is stored per large TIFF file, keyed by its file name. Each annotation holds the final locations of the selected regions of interest, the rotations applied to the image and, for every counted channel, the brightness index (defaulting to 160), the minimum area to classify as a neuron / cell and the maximum cluster area.
+#
+# The keys above set the red channel. Other channels (a second fluorophore) are added on the command line with their own 8-bit brightness, scaled like the presets, or "auto": --channel green=200 --channel blue=auto. Every channel is counted in every region of interest.
 
-# In[ ]:
-
-
-# Starting point
-n = 0
-p = 0
-
-while n < len(onlyfiles):
-
-    images[n] = cv2.imread(join(mypath,onlyfiles[n]))
-    r_images[n] = cv2.imread(join(r_mypath,r_onlyfiles[n]))
-     
-    piet = images[n]
-    
-    while True:
-    
-        cv2.imshow(str(n) + " / " + str(len(onlyfiles)) + " " + str(onlyfiles[n]), piet)
-
-
-        key = cv2.waitKey(1) & 0xFF
-        
-        #User input conditionals:
-            
-        if key == ord('w'):
-            piet = rotate_image(piet, 7)
-            r_images[n] = rotate_image(r_images[n], 7)
-            cv2.destroyAllWindows()
-            
-        if key == ord('e'):
-            piet = rotate_image(piet, -7)
-            r_images[n] = rotate_image(r_images[n], -7)
-            cv2.destroyAllWindows()
-            
-        if key == ord('o'):
-            piet = rotate_image(piet, 180)
-            r_images[n] = rotate_image(r_images[n], 180)
-            cv2.destroyAllWindows()
-        
-        if key == ord('t'):
-            break
-        if key == ord('m'):
-            break
-        if key == ord('u'):
-            break
-        if key == ord('q'):
-            break
-        if key == ord('v'):
-            break
-        if key == ord('p'):
-            break
-        if key == ord('i'):
-            break
-    
-    if key == ord('u'):
-        # If the "u" key is pressed, the program erases all information on the previous image and allows the user to redo the box selection
-        
-        xpos1.pop()
-        xpos2.pop()
-        ypos1.pop()
-        ypos2.pop()
-        bright.pop()
-        min_area_list.pop()
-        cluster_max.pop()
-        
-        # Changing the iteration index here:
-        n = n - 1
-        continue
-        
-    if key == ord('q'):
-        
-        #Ask user for the input value (if nothing is inputed then default brightness at 160)
-        
-        bright_temp = int(input("Enter brightness value: "))
-        min_area = 40
-        cv2.destroyAllWindows()
-        #Perform the identification of neurons algorithm
-        
-        # Selecting Region of Interest
-        r = cv2.selectROI("select the area", piet)
-
-        # Cropping the image to selected box
-        cropped_image = piet[int(r[1]):int(r[1]+r[3]), 
-                              int(r[0]):int(r[0]+r[2])]
-
-        # Finding middle of selected box
-        middle = r[2] / 2
-
-        x1, y1 = int(r[0]), int(r[1])
-        x2, y2 = int(r[0]+r[2]), int(r[1]+r[3])
-
-        ratio = len(r_images[n]) / len(piet)
-        ratio2 = r_images[n].shape[1] / piet.shape[1]
-
-        # Reproportioning small boxes to the larger TIFF images
-        nx1, ny1 = int(x1 * ratio), int(y1 * ratio2)
-        nx2, ny2 = int(x2 * ratio), int(y2 * ratio2)
-        
-        #Now to process the image:
-        
-        piat = r_images[n]
-        cropped_image = piat[ny1:ny2, nx1:nx2]
-
-        # Identifying the middle to later sort counts into left / right arrays
-        middle = (nx2 - nx1) / 2
-
-        # Converting the cropped image to RGB format to allow for PIL manipulations
-        color_coverted = cv2.cvtColor(cropped_image, cv2.COLOR_BGR2RGB)
-        image = PIL.Image.fromarray(color_coverted)
-        pix = image.load()
-
-        width, height = image.size
-
-        # Contrast filter: interating through each pixel of the cropped_image. 
-        # Due to the relatively small area of the cropped_image, this does not take too much time. 
-        for y in range(height):
-            for x in range(width):
-                r = pix[x,y][0]
-                rng = range(bright_temp, 255, 1)
-                if r in rng:
-                    pix[x, y] = (255, 0, 0)
-                else:
-                    pix[x, y] = (0, 0, 0)
-
-        cvimg = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-
-        img = cv2.cvtColor(cvimg, cv2.COLOR_BGR2GRAY)
-
-        # Finding countours of potential cells to count: 
-        cnts = cv2.findContours(img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-        cnts = cnts[0] if len(cnts) == 2 else cnts[1]
-
-
-        # Initializing left / right arrays for the specific image as well as the max_area constant.
-        # The max area constant can be approximated by the user after a few trail images are counted. 
-        max_area = 900
-
-        area_list = []
-
-        # Counting with OpenCV Countour function
-
-        for c in cnts:
-            (x,y),radius = cv2.minEnclosingCircle(c)
-            area = cv2.contourArea(c)
-            area_list.append(area)
-            if area > min_area and area < max_area:
-                # Drawing green countour over counted cells: 
-                cv2.drawContours(cropped_image, [c], -1, (0, 250, 0), 2)
-
-
-        # CLUSTER ALGORITHM:
-        if len(area_list) > 3: # Requires at least 3 normal cells to be present in the image
-            Biggest_Cell_area = np.percentile(area_list, 99)
-
-            for c1 in cnts:
-                area = cv2.contourArea(c1)
-                if area > max_area and area < 10000:
-                    # Drawing a blue contour around identified clusters of cells: 
-                    cv2.drawContours(cropped_image, [c1], -1, (250, 0, 0), 3)
-        
-        #Show the processed image
-        cluster_max.append(10000)
-        cv2.imshow("Check", cropped_image)
-        cv2.waitKey()
-
-        cv2.destroyAllWindows()
-        
-        #Go back to the same image to select the box again (same algorithm as the u key one)
-        continue
-            
-            
-    cv2.destroyAllWindows()
-    
+def select_roi(piet, header):
     # Selecting Region of Interest
     r = cv2.selectROI("select the area", piet)
-    
-    # Cropping the image to selected box
-    cropped_image = piet[int(r[1]):int(r[1]+r[3]), 
-                          int(r[0]):int(r[0]+r[2])]
-    
-    # Finding middle of selected box
-    middle = r[2] / 2
-    
+
     x1, y1 = int(r[0]), int(r[1])
     x2, y2 = int(r[0]+r[2]), int(r[1]+r[3])
-    
-    ratio = len(r_images[n]) / len(piet)
-    ratio2 = r_images[n].shape[1] / piet.shape[1]
-    
+
+    ratio = header.height / len(piet)
+    ratio2 = header.width / piet.shape[1]
+
     # Reproportioning small boxes to the larger TIFF images
     nx1, ny1 = int(x1 * ratio), int(y1 * ratio2)
     nx2, ny2 = int(x2 * ratio), int(y2 * ratio2)
-    
-    # Updating values to array lists
-    
-    xpos1.append(nx1)
-    xpos2.append(nx2)
-    ypos1.append(ny1)
-    ypos2.append(ny2)
-    
-    if key == ord('t'):  
-        bright.append(160)
-        min_area_list.append(40)
-        cluster_max.append(10000)
-    elif key == ord('p'):
-        bright.append(250)
-        min_area_list.append(40)
-        cluster_max.append(10000)
-    elif key == ord('v'):
-        bright.append(200)
-        min_area_list.append(40)
-        cluster_max.append(10000)
-    elif key == ord('i'):
-        temp = int(input("Brightness value:"))
-        bright.append(temp)
-        min_area_list.append(40)
-        cluster_max.append(1000000)
-    else:
-        bright.append(160)
-        min_area_list.append(40)
-        cluster_max.append(10000)
-        
-    if key == ord('m'):
-            break
-            
-    # Give user warning if no box is selected for an image (User will need to redo this image by pressing "U" key)
-    if y2 == 0:     
-        print("Caution Error at " + str(n))
-    
-    n += 1
- 
-
-
-# <a id="7"></a> <br>
-# # Iterating and Counting through Large TIFF Files Autonomously
-# 
-# This For Loop iterates through all the larger TIFF files and applies filters to count the cells and identify clusters of cells.
-# 
-# ## 1. Contrast Filter to remove all background noise and filter all bright cells within a brightness range
-# The program then converts the filtered image back into an OpenCV file to perform later operations.
-# 
-# ## 2. Cluster Algorithm:
-# 
-# For clusters of cells, the program identifies any areas of bright flourescent color with an area of greater than 900 pixels as a cluster (900 is a constant). The program procceeds to get the area of the biggest cell to try and fit as many of that big cell into the area of the cluster. In short, the program divides the area of the cluster by the area of the single biggest cell and rounds up. That number is then added to the corresponding left or right counts (and reported to the user)
-# 
-
-# In[ ]:
-
-
-for n in range(0, len(xpos1)):
-
-    piat = r_images[n]
-    cropped_image = piat[ypos1[n]:ypos2[n], xpos1[n]:xpos2[n]]
-    
-    # Identifying the middle to later sort counts into left / right arrays
-    middle = (xpos2[n] - xpos1[n]) / 2
-    
-    # Converting the cropped image to RGB format to allow for PIL manipulations
-    color_coverted = cv2.cvtColor(cropped_image, cv2.COLOR_BGR2RGB)
-    image = PIL.Image.fromarray(color_coverted)
-    pix = image.load()
-    
-    width, height = image.size
-    
-    # Contrast filter: interating through each pixel of the cropped_image. 
-    # Due to the relatively small area of the cropped_image, this does not take too much time. 
-    for y in range(height):
-        for x in range(width):
-            r = pix[x,y][0]
-            rng = range(bright[n], 255, 1)
-            if r in rng:
-                pix[x, y] = (255, 0, 0)
+    return nx1, ny1, nx2, ny2
+
+
+def choose_roi(piet, header, tiled, rotation):
+    # The tiled viewer works on the large TIFF itself, so its box needs no reproportioning
+    if tiled is None:
+        return select_roi(piet, header)
+    tiled.set_rotations(rotation)
+    return pan_zoom_roi(tiled)
+
+
+def channel_option(text):
+    # "--channel green=200" or "--channel c2=auto": (name, 8-bit brightness or None for the automatic threshold)
+    name, _, bright = text.partition("=")
+    # The red channel is set with the keys of the interactive loop; c1, c2... are the channels of hyperstacks
+    if not (name in CHANNELS and name != "red" or re.fullmatch(r"c[1-9][0-9]*", name)) or not bright:
+        raise argparse.ArgumentTypeError("expected NAME=BRIGHTNESS or NAME=auto with NAME green, blue or c1, c2...")
+    if bright == "auto":
+        return name, None
+    try:
+        return name, int(bright)
+    except ValueError:
+        raise argparse.ArgumentTypeError("invalid brightness " + repr(bright))
+
+
+def annotate_images(r_mypath, r_onlyfiles, mypath, onlyfiles, projection="max", extra_channels=(), viewer=False,
+                    bits=None):
+    annotations = AnnotationStore()
+
+    # Starting point
+    n = 0
+    shown = None
+    tiled = None
+
+    while n < len(onlyfiles):
+
+        if shown != n:
+            # Only the header (size and bit depth) of the large TIFF file is read here; the pixels are decoded later by the counting workers
+            header = probe_image(join(r_mypath,r_onlyfiles[n]))
+            # Significant bits of the samples (12 for 12-bit data stored in 16-bit samples), unless set with --bits
+            sample_bits = bits if bits is not None else header.significant_bits
+            # Channels this image has; hyperstacks have no red, so their first channel is the main one
+            available = channel_names(header)
+            main_channel = "red" if "red" in available else available[0]
+            if viewer:
+                # The preview is the overview of the tiled viewer, which is taken from the smaller copy if there is one
+                if tiled is not None:
+                    tiled.close()
+                tiled = TiledImage(join(r_mypath,r_onlyfiles[n]), projection=projection, bits=sample_bits,
+                                   preview=join(mypath,onlyfiles[n]) if mypath is not None else None)
+                piet = tiled.fit(*VIEW_SIZE)
             else:
-                pix[x, y] = (0, 0, 0)
-
-    cvimg = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
-
-    img = cv2.cvtColor(cvimg, cv2.COLOR_BGR2GRAY)
-    
-    # Finding countours of potential cells to count: 
-    cnts = cv2.findContours(img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    cnts = cnts[0] if len(cnts) == 2 else cnts[1]
-    
-    
-    # Initializing left / right arrays for the specific image as well as the max_area constant.
-    # The max area constant can be approximated by the user after a few trail images are counted. 
-    max_area = 900
-    left_white_dots = []
-    right_white_dots = []
-
-    
-    area_list = []
-    
-    # Counting with OpenCV Countour function
-    
-    for c in cnts:
-        area = cv2.contourArea(c)
-        if area > min_area_list[n] and area < max_area:
-            # Drawing green countour over counted cells: 
-            cv2.drawContours(cropped_image, [c], -1, (0, 250, 0), 2)
-            # Extracting useful information about the location of each countour in coordinates:
-            (x,y),radius = cv2.minEnclosingCircle(c)
-            # Sorting which cells are on the left and right side of the middle: 
-            if x < middle:
-                left_white_dots.append(c)
-            elif x > middle:
-                right_white_dots.append(c)
-            area_list.append(area)
-            
-    
-    # CLUSTER ALGORITHM:
-
-    
-    if len(area_list) > 3: # Requires at least 3 normal cells to be present in the image
-        Biggest_Cell_area = np.percentile(area_list, 99)
-
-        for c1 in cnts:
-            area = cv2.contourArea(c1)
-            if area > max_area and area < cluster_max[n]:
-                # Drawing a blue contour around identified clusters of cells: 
-                cv2.drawContours(cropped_image, [c1], -1, (250, 0, 0), 2)
-                (x,y),radius = cv2.minEnclosingCircle(c1)
-                # Check stores the minimum number of cells within the identified clusters:
-                check = int((area / Biggest_Cell_area) + 1)
-                
-                # Adding the cluster counts to each respective side and reporting this to the user:
-                if x < middle:
-                    for i in range(0, check):
-                        left_white_dots.append(c1)
-                    print("Added to left: ", check)
-                elif x > middle:
-                    for i in range(0, check):
-                        right_white_dots.append(c1)
-                    print("Added to right: ", check)
-                
-    print(onlyfiles[n])       
-    print("Left count - Right count: ",len(left_white_dots), len(right_white_dots))
-    
-    final_count.append(onlyfiles[n])
-    left_count.append(len(left_white_dots))
-    right_count.append(len(right_white_dots))
-    
-    
-
-    finished.append(cropped_image)
-    cv2.destroyAllWindows()
+                piet = cv2.imread(join(mypath,onlyfiles[n]))
 
+            # The rotations are only recorded for the large TIFF; the counting stage replays them
+            rotation = []
+            # Extra regions of interest selected with "n", by name
+            extra_rois = {}
+            shown = n
 
-# ### Display regions of interests with counted cells only if there are less than 10 images analyzed
-#  If there are more than 10 images analyzed, there may be too many images to display for the computer, resulting in overloading.
+        while True:
 
-# In[ ]:
+            cv2.imshow(str(n) + " / " + str(len(onlyfiles)) + " " + str(onlyfiles[n]), piet)
 
 
-if len(finished) < 10:
-    for n in range(0, len(finished)):
-        cv2.imshow(onlyfiles[i], finished[n])
-        cv2.waitKey()
-
-print(len(xpos1))
-
-
-# <a id="8"></a> <br>
-# # Add counts to a blank Excel file and color code the data
-# 
-# This program sorts through the blank Excel input and enters all the left counts in the left counts table and the right counts in the right count table. The program also color codes the data based on the number and region of spinal cord.
-# 
-# The specific color code of the data depends on the naming nomenclature. In our case we use 3556.1 s_1. "3556.1" represents the mouse number and "s_1" represents the first spinal cord from that mouse number. All spinal cords from the same mouse have the same highlighted color in the Excel file. 
-
-# In[ ]:
-
-
-for n in range(0, len(onlyfiles)):
-    final_count[n] = onlyfiles[n]
-
-
-# This is simply the name of the first image:
-y = onlyfiles[0]
-
-# The index value [5:13] represent the string "3730.4 "from the initial name "Zymo6 3730.4 1-12_s11.tif"
-# "3730.4 " represents the tag of the animal from which the section was collected. 
-# Hence, these index values below will change according to the user's naming choice
-name = y[6:13] #NAMING
-
-# Row counter and Coloumn counter
-sheet.cell(row = 1, column = 1).value = "Left Counts (NEED TO CHECK BLUE DYE)"
-sheet.cell(row = 36, column = 1).value = "Right Counts (NEED TO CHECK BLUE DYE)"
-
-for i in range(1, 30):
-    sheet.cell(row = 2, column = i + 1).value = i
-    sheet.cell(row = 37, column = i + 1).value = i
-
-r = 3
-c = 1
-full = '\t'.join(onlyfiles)
-sheet.cell(row = r, column = c).value = name
-sheet.cell(row = r + 35, column = c).value = name
-
-print(onlyfiles)
-print(left_count)
-print(right_count)
-print(name in final_count[0])
-
-
-for n in range(0, len(onlyfiles)):
-    # If the section is from the same animal as before, continue on the same row (each animal has its own row)
-    if name in onlyfiles[n]:
-        c = c + 1
-        # Add the left count to the top table
-        sheet.cell(row = r, column = c).value = left_count[n]
-        # Add the right count to the bottom table
-        sheet.cell(row = r + 35, column = c).value = right_count[n]
-        
-        # Conditional statements for color coding (via highlighting):
-        # If sections are from different regions of the brain / spinal cord, the user can enter A1 - E4 codes in the file name to allow for each color coding
-        if "A1" in final_count[n]:
-            color = 27
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "A2" in final_count[n]:
-            color = 44
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "A3" in final_count[n]:
-            color = 49
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "A4" in final_count[n]:
-            color = 4
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "B1" in final_count[n]:
-            color = 5
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "B2" in final_count[n]:
-            color = 50
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "B3" in final_count[n]:
-            color = 57
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "B4" in final_count[n]:
-            color = 19
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "C1" in final_count[n]:
-            color = 45
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "C2" in final_count[n]:
-            color = 29
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "C3" in final_count[n]:
-            color = 22
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "C4" in final_count[n]:
-            color = 23
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-    
-    # Else if there is a new animal tag, move on to the next row.
-    
-    else:
-        c = 1
-        r = r + 1
-        name = final_count[n][6:13] #NAMING
-        sheet.cell(row = r, column = c).value = name
-        sheet.cell(row = r + 35, column = c).value = name
-        c = c + 1
-        sheet.cell(row = r, column = c).value = left_count[n]
-        sheet.cell(row = r + 35, column = c).value = right_count[n]
-        
-        
-        
-        
-        # Same color coding technique here: 
-        if "A1" in final_count[n]:
-            color = 27
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "A2" in final_count[n]:
-            color = 44
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "A3" in final_count[n]:
-            color = 49
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "A4" in final_count[n]:
-            color = 4
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "B1" in final_count[n]:
-            color = 5
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "B2" in final_count[n]:
-            color = 50
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "B3" in final_count[n]:
-            color = 57
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "B4" in final_count[n]:
-            color = 19
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "C1" in final_count[n]:
-            color = 45
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "C2" in final_count[n]:
-            color = 29
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "C3" in final_count[n]:
-            color = 22
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-        elif "C4" in final_count[n]:
-            color = 23
-            temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-            sheet.cell(row = r, column = c).fill = temp
-            sheet.cell(row = r + 35, column = c).fill = temp
-
-
-# <a id="9"></a> <br>
-# ## Display the Color Code on Row 60 of the Excel document
-
-# In[ ]:
-
-
-sheet.cell(row = 90, column = 1).value = "Color code: "
-sheet.cell(row = 90, column = 2).value = "A1"
-color = 27
-temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-sheet.cell(row = 90, column = 2).fill = temp
-
-sheet.cell(row = 90, column = 3).value = "A2"
-color = 44
-temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-sheet.cell(row = 90, column = 3).fill = temp
-
-sheet.cell(row = 90, column = 4).value = "A3"
-color = 49
-temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-sheet.cell(row = 90, column = 4).fill = temp
-
-sheet.cell(row = 90, column = 5).value = "A4"
-color = 4
-temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-sheet.cell(row = 90, column = 5).fill = temp
-
-sheet.cell(row = 90, column = 6).value = "B1"
-color = 5
-temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-sheet.cell(row = 90, column = 6).fill = temp
-
-sheet.cell(row = 90, column = 7).value = "B2"
-color = 50
-temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-sheet.cell(row = 90, column = 7).fill = temp
-
-sheet.cell(row = 90, column = 8).value = "B3"
-color = 57
-temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-sheet.cell(row = 90, column = 8).fill = temp
-
-sheet.cell(row = 90, column = 9).value = "B4"
-color = 19
-temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-sheet.cell(row = 90, column = 9).fill = temp
-
-sheet.cell(row = 90, column = 10).value = "C1"
-color = 45
-temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-sheet.cell(row = 90, column = 10).fill = temp
-
-sheet.cell(row = 90, column = 11).value = "C2"
-color = 29
-temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-sheet.cell(row = 90, column = 11).fill = temp
-
-sheet.cell(row = 90, column = 12).value = "C3"
-color = 22
-temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-sheet.cell(row = 90, column = 12).fill = temp
-
-sheet.cell(row = 90, column = 13).value = "C4"
-color = 23
-temp = PatternFill(patternType='solid', fgColor=Color(indexed=color))
-sheet.cell(row = 90, column = 13).fill = temp
-
-            
-# Save the results in a new file called "cell_counts.xlsx"
-obj.save(filename="cell_counts.xlsx")
-print("Completed")
-
-
-# In[ ]:
-
-
-yo = "CFA 30.14 01-12_s1.tif"
-yo2 = yo[8:15]
-print(yo2)
-
-
-# In[ ]:
-
+            key = cv2.waitKey(1) & 0xFF
 
+            #User input conditionals:
 
+            if key in (ord('w'), ord('e'), ord('o')) and extra_rois:
+                # The extra regions of interest are boxes on the image as it is now, so it can no longer be rotated
+                print("Caution: rotate the image before selecting extra regions of interest, the rotation is ignored")
+                continue
 
+            if key == ord('w'):
+                piet = rotate_image(piet, 7)
+                rotation.append(7)
+                cv2.destroyAllWindows()
 
-# In[ ]:
+            if key == ord('e'):
+                piet = rotate_image(piet, -7)
+                rotation.append(-7)
+                cv2.destroyAllWindows()
 
+            if key == ord('o'):
+                piet = rotate_image(piet, 180)
+                rotation.append(180)
+                cv2.destroyAllWindows()
 
+            if key in (ord('t'), ord('m'), ord('u'), ord('r'), ord('q'), ord('v'), ord('p'), ord('i'), ord('a'), ord('n')):
+                break
 
+        if key == ord('u'):
+            # If the "u" key is pressed, the program erases all information on the previous image and allows the user to redo the box selection
 
+            undone = annotations.undo()
+            cv2.destroyAllWindows()
 
-# In[ ]:
-
-
-
-
-
-# In[ ]:
-
-
+            # Changing the iteration index here:
+            if undone is not None:
+                n = r_onlyfiles.index(undone)
+            continue
 
+        if key == ord('r'):
+            # If the "r" key is pressed, the program restores the last image erased with "u" and moves on to the image after it
 
+            redone = annotations.redo()
+            cv2.destroyAllWindows()
 
-# In[ ]:
+            if redone is not None:
+                n = r_onlyfiles.index(redone) + 1
+            continue
 
+        if key == ord('q'):
 
+            #Ask user for the input value (if nothing is inputed then default brightness at 160)
 
+            bright_temp = int(input("Enter brightness value (0 - " + str(2 ** sample_bits - 1) + "): "))
+            min_area = 40
+            cv2.destroyAllWindows()
+            #Perform the identification of neurons algorithm
 
+            #Now to process the image:
+            cropped_image = load_roi(join(r_mypath,r_onlyfiles[n]), rotation, choose_roi(piet, header, tiled, rotation), projection)
 
-# In[ ]:
+            img = contrast_filter(cropped_image, bright_temp, main_channel, sample_bits)
+            # The contours are drawn on an 8-bit copy for display
+            cropped_image = to_bgr8(cropped_image, sample_bits)
 
+            # Finding countours of potential cells to count:
+            cnts = cv2.findContours(img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+            cnts = cnts[0] if len(cnts) == 2 else cnts[1]
 
+            # Counting with OpenCV Countour function
+            area_list = []
 
+            for c in cnts:
+                area = cv2.contourArea(c)
+                area_list.append(area)
+                if area > min_area and area < MAX_AREA:
+                    # Drawing green countour over counted cells:
+                    cv2.drawContours(cropped_image, [c], -1, (0, 250, 0), 2)
 
 
-# In[ ]:
+            # CLUSTER ALGORITHM:
+            if len(area_list) > 3: # Requires at least 3 normal cells to be present in the image
+                for c1 in cnts:
+                    area = cv2.contourArea(c1)
+                    if area > MAX_AREA and area < 10000:
+                        # Drawing a blue contour around identified clusters of cells:
+                        cv2.drawContours(cropped_image, [c1], -1, (250, 0, 0), 3)
 
+            #Show the processed image
+            cv2.imshow("Check", cropped_image)
+            cv2.waitKey()
 
+            cv2.destroyAllWindows()
 
+            #Go back to the same image to select the box again (same algorithm as the u key one)
+            continue
 
+        if key == ord('n'):
+            cv2.destroyAllWindows()
 
-# In[ ]:
+            # Selecting an extra region of interest and naming it, then going back to the same image
+            extra_roi = choose_roi(piet, header, tiled, rotation)
+            name = ""
+            while not name or name == DEFAULT_ROI:
+                name = input("Name of this region of interest: ").strip()
+            extra_rois[name] = extra_roi
+            continue
 
 
+        cv2.destroyAllWindows()
 
+        roi = choose_roi(piet, header, tiled, rotation)
 
+        # Updating the annotation of this image (the brightness presets are 8-bit values, scaled to the significant bits of the large TIFF)
 
-# In[ ]:
+        if key == ord('t'):
+            red = Channel(main_channel, bright=native_brightness(160, sample_bits), min_area=40, cluster_max=10000)
+        elif key == ord('p'):
+            red = Channel(main_channel, bright=native_brightness(250, sample_bits), min_area=40, cluster_max=10000)
+        elif key == ord('v'):
+            red = Channel(main_channel, bright=native_brightness(200, sample_bits), min_area=40, cluster_max=10000)
+        elif key == ord('a'):
+            red = Channel(main_channel, min_area=40, cluster_max=10000, threshold="auto")
+        elif key == ord('i'):
+            temp = int(input("Brightness value (0 - " + str(2 ** sample_bits - 1) + "):"))
+            red = Channel(main_channel, bright=temp, min_area=40, cluster_max=1000000)
+        else:
+            red = Channel(main_channel, bright=native_brightness(160, sample_bits), min_area=40, cluster_max=10000)
+
+        channels = [red]
+        for name, bright in extra_channels:
+            if name == main_channel:
+                # Already counted as the main channel of this image
+                continue
+            if name not in available:
+                # A single-channel image has no green, a two-channel hyperstack no c3...
+                print("Caution: " + r_onlyfiles[n] + " has no " + name + " channel, it is not counted")
+                continue
+            if bright is None:
+                channels.append(Channel(name, min_area=40, cluster_max=10000, threshold="auto"))
+            else:
+                channels.append(Channel(name, bright=native_brightness(bright, sample_bits), min_area=40, cluster_max=10000))
 
+        # The main region of interest comes first
+        rois = {DEFAULT_ROI: roi}
+        rois.update(extra_rois)
 
+        annotations.set(Annotation(r_onlyfiles[n], rois, rotation, channels))
 
+        if key == ord('m'):
+                break
 
+        # Give user warning if no box is selected for an image (User will need to redo this image by pressing "U" key)
+        if roi[3] == 0:
+            print("Caution Error at " + str(n))
 
-# In[ ]:
+        n += 1
 
+    if tiled is not None:
+        tiled.close()
+    return annotations
 
 
+# <a id="7"></a> <br>
+# # Iterating and Counting through Large TIFF Files Autonomously
+#
+# The counting stage (cellcount/counting.py) runs on every larger TIFF file and applies filters to count the cells and identify clusters of cells.
+#
+# ## 1. Contrast Filter to remove all background noise and filter all bright cells within a brightness range
+# The program then converts the filtered image back into an OpenCV file to perform later operations.
+#
+# ## 2. Cluster Algorithm:
+#
+# For clusters of cells, the program identifies any areas of bright flourescent color with an area of greater than 900 pixels as a cluster (900 is a constant). The program procceeds to get the area of the biggest cell to try and fit as many of that big cell into the area of the cluster. In short, the program divides the area of the cluster by the area of the single biggest cell and rounds up. That number is then added to the corresponding left or right counts (and reported to the user)
+#
+# ## 3. Z-stacks:
+#
+# Multi-page (confocal z-stack) TIFF files do not need to be projected in another tool first. Their pages are read one at a time and combined into a maximum intensity projection of the region of interest (or a sum / mean projection with --projection), which is then counted like any other image. The smaller preview image should show the same projection.
+#
+# ## 4. Scheduling:
+#
+# The images are counted in parallel worker processes (cellcount/scheduler.py). Before counting, the size of each image is read from its header and used to estimate how much memory counting it will take. A new image is only started while the estimates of all images being counted fit in "memory_budget", so large TIFF files run next to few others and small images run many at a time. Lower "memory_budget" (--memory-budget) if the computer runs out of memory, or set "max_workers" (--workers) to 1 to count one image at a time.
+#
+# ## 5. Several regions of interest and channels:
+#
+# Every image is decoded once; each of its regions of interest is copied out and every channel is counted in every region of interest. The counts are keyed by (image, region of interest, channel).
+#
+# The regions of interests with counted cells are only displayed if there are less than 10 images analyzed. If there are more than 10 images analyzed, there may be too many images to display for the computer, resulting in overloading.
+
+def count_images(r_mypath, r_onlyfiles, annotations, memory_budget=None, max_workers=None, projection="max", bits=None):
+    from cellcount.scheduler import CountJob, run_jobs
+
+    # Counting every annotated image in file order
+    counted = annotations.ordered(r_onlyfiles)
+
+    jobs = []
+    for annotation in counted:
+        jobs.append(CountJob(join(r_mypath,annotation.file), annotation, projection, bits))
+
+    # The counted regions of interest are only kept if they will be displayed below
+    results = run_jobs(jobs, memory_budget=memory_budget, max_workers=max_workers, keep_overlays=len(jobs) < 10)
+
+    # (file, region of interest, channel) -> CountResult, in file order
+    counts = {}
+    for n in range(0, len(results)):
+        for (roi, channel), result in results[n].items():
+
+            # Reporting the cluster counts added to each side to the user:
+            for side, check in result.clusters:
+                print("Added to " + side + ": ", check)
+
+            print(counted[n].file, roi, channel)
+            print("Left count - Right count: ", result.left, result.right)
+
+            counts[counted[n].file, roi, channel] = result
+
+    # Display regions of interests with counted cells
+    for (file, roi, channel), result in counts.items():
+        if result.overlay is not None:
+            cv2.imshow(file + " " + roi + " " + channel, result.overlay)
+            cv2.waitKey()
 
+    cv2.destroyAllWindows()
+    print(len(annotations))
 
-# In[ ]:
+    return counts
 
 
+# <a id="8"></a> <br>
+# # Add counts to a blank Excel file and color code the data
+#
+# All counts are collected into one table (cellcount/summary.py) with a row per image, region of interest and channel. The animal, section and region of each image are parsed from its file name, so the order of the files does not matter. The table can be saved to a CSV file with --results.
+#
+# The program (cellcount/excel.py) enters the left counts of the main region of interest and main channel of each image (red, or c1 for hyperstacks) in the left counts table and the right counts in the right count table of the blank Excel input, with a row per animal and a column per section (and region, when one section has images of several regions). The program also color codes the data based on the number and region of spinal cord. The per-animal totals and per-region means (with left / right ratios) of every region of interest and channel are added on the "Per animal" and "Per region" sheets.
+#
+# The specific color code of the data depends on the naming nomenclature. In our case we use 3556.1 s_1. "3556.1" represents the mouse number and "s_1" represents the first spinal cord from that mouse number (see NAME_PATTERN in cellcount/summary.py to parse other names). All spinal cords from the same mouse have the same highlighted color in the Excel file. If sections are from different regions of the brain / spinal cord, the user can enter A1 - C4 codes in the file name to allow for each color coding; the color code is displayed on row 90 of the Excel document (further down if there are many animals).
 
 
+# <a id="9"></a> <br>
+# # Command line
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count fluorescent cells on the left and right side of selected regions of interest.")
+    parser.add_argument("pics", help="folder with the large TIFF images that are counted")
+    parser.add_argument("previews", nargs="?",
+                        help="folder with the smaller, resized copies used to select the regions of interest "
+                             "(optional with --viewer, which then uses them as overviews)")
+    parser.add_argument("--viewer", action="store_true",
+                        help="select the regions of interest on the large images in a tiled pan / zoom viewer instead of the previews")
+    parser.add_argument("--input", default="input.xlsx", help="blank Excel file to fill in (default: input.xlsx)")
+    parser.add_argument("--output", default="cell_counts.xlsx", help="where to save the counts (default: cell_counts.xlsx)")
+    parser.add_argument("--memory-budget", type=float, default=None, metavar="GB",
+                        help="memory the counting workers may use together (default: half of the computer's memory)")
+    parser.add_argument("--workers", type=int, default=None, help="maximum number of counting workers (default: one per CPU)")
+    parser.add_argument("--projection", choices=PROJECTIONS, default="max",
+                        help="how the pages of multi-page (z-stack) TIFFs are combined (default: max)")
+    parser.add_argument("--bits", type=int, default=None,
+                        help="significant bits per sample of the large images, e.g. 12 for 12-bit data in 16-bit TIFFs "
+                             "(default: read from the TIFF tags, else the sample size)")
+    parser.add_argument("--channel", type=channel_option, action="append", default=[], metavar="NAME=BRIGHTNESS",
+                        help="also count this channel (green, blue, or c1, c2... of hyperstacks) with an 8-bit "
+                             "brightness or 'auto'; images without it are skipped; can be repeated")
+    parser.add_argument("--results", metavar="PATH",
+                        help="save the counts of every image, region of interest and channel to a CSV file")
+    parser.add_argument("--save-annotations", metavar="PATH",
+                        help="save the selected boxes and settings to a JSON file (used by python -m cellcount.calibration)")
+    args = parser.parse_args(argv)
+
+    from cellcount.excel import write_counts
+    from cellcount.summary import duplicate_names, results_frame
+
+    if args.viewer and args.previews is None:
+        r_onlyfiles = list_images(args.pics)
+        onlyfiles = r_onlyfiles
+    elif args.previews is None:
+        parser.error("the previews folder is required without --viewer")
+    else:
+        r_onlyfiles, onlyfiles = load_file_lists(args.pics, args.previews)
+    # Files the Excel tables cannot tell apart are reported before any box is drawn, not after the counting
+    duplicates = duplicate_names(r_onlyfiles)
+    if duplicates:
+        parser.error("files with the same animal, section and region (rename them or change NAME_PATTERN in "
+                     "cellcount/summary.py): " + "; ".join(", ".join(group) for group in duplicates))
+    annotations = annotate_images(args.pics, r_onlyfiles, args.previews, onlyfiles, args.projection, args.channel,
+                                  args.viewer, args.bits)
+    if args.save_annotations:
+        annotations.save(args.save_annotations)
+
+    memory_budget = None if args.memory_budget is None else int(args.memory_budget * 1024 ** 3)
+    counts = count_images(args.pics, r_onlyfiles, annotations, memory_budget, args.workers, args.projection, args.bits)
+    frame = results_frame(counts)
+    if args.results:
+        frame.to_csv(args.results, index=False)
+
+    # Save the results in a new file (called "cell_counts.xlsx" by default), with the main channel of every image
+    main_channels = {annotation.file: annotation.channels[0].name for annotation in annotations.ordered(r_onlyfiles)}
+    write_counts(frame, args.input, args.output, roi=DEFAULT_ROI, channel=main_channels)
+    print("Completed")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+# cellcount: the counting core of EasyCellCounting.py, kept importable so that
+# the counting stage can run in worker processes.
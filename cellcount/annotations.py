@@ -0,0 +1,164 @@
+# Per-image annotations made in the interactive loop, with undo / redo.
+
+import json
+
+
+# Name of the ROI selected with the preset keys; further ROIs are named by the user.
+DEFAULT_ROI = "roi"
+
+
+class _Record:
+    # Equality, repr and plain-dict conversion from __slots__
+
+    __slots__ = ()
+
+    def __eq__(self, other):
+        if type(other) is not type(self):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __repr__(self):
+        fields = ", ".join(name + "=" + repr(getattr(self, name)) for name in self.__slots__)
+        return type(self).__name__ + "(" + fields + ")"
+
+
+class Channel(_Record):
+    """Counting settings of one channel of an image.
+
+    name is one of images.CHANNELS ("red" is the only plane of a
+    single-channel image). threshold is "fixed" (use bright, in the native
+    units of the image) or "auto" (background subtraction and Otsu, see
+    counting.py).
+    """
+
+    __slots__ = ("name", "bright", "min_area", "cluster_max", "threshold")
+
+    def __init__(self, name="red", bright=160, min_area=40, cluster_max=10000, threshold="fixed"):
+        self.name = name
+        self.bright = bright
+        self.min_area = min_area
+        self.cluster_max = cluster_max
+        self.threshold = threshold
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+class Annotation(_Record):
+    """Everything the counting stage needs to know about one image.
+
+    rois maps ROI names to (x1, y1, x2, y2) boxes in full-resolution pixels
+    (the first one is the image's main ROI) and rotations is the list of angles
+    the user applied, in order. Every channel in channels is counted in every
+    ROI, from a single decode of the image.
+    """
+
+    __slots__ = ("file", "rois", "rotations", "channels")
+
+    def __init__(self, file, rois, rotations=(), channels=None):
+        self.file = file
+        self.rois = {name: tuple(roi) for name, roi in rois.items()}
+        self.rotations = tuple(rotations)
+        self.channels = (Channel(),) if channels is None else tuple(channels)
+
+    def to_dict(self):
+        data = super().to_dict()
+        data["channels"] = [channel.to_dict() for channel in self.channels]
+        return data
+
+    @classmethod
+    def from_dict(cls, data):
+        data = dict(data)
+        if "roi" in data:
+            # Saved before annotations had several ROIs and channels: one ROI,
+            # counted on the red channel with the settings stored next to it
+            settings = {name: data.pop(name) for name in Channel.__slots__[1:] if name in data}
+            data["rois"] = {DEFAULT_ROI: data.pop("roi")}
+            data["channels"] = [Channel(**settings)]
+        else:
+            data["channels"] = [Channel.from_dict(channel) for channel in data["channels"]]
+        return cls(**data)
+
+
+class AnnotationStore:
+    """Annotations keyed by file name, with an undo / redo history.
+
+    Every change is recorded as (file, previous annotation or None), so undo
+    and redo are O(1) and can never leave the fields of an image out of step.
+    """
+
+    def __init__(self):
+        self._annotations = {}
+        self._undo = []
+        self._redo = []
+
+    def __len__(self):
+        return len(self._annotations)
+
+    def __contains__(self, file):
+        return file in self._annotations
+
+    def __getitem__(self, file):
+        return self._annotations[file]
+
+    def get(self, file, default=None):
+        return self._annotations.get(file, default)
+
+    def files(self):
+        return list(self._annotations)
+
+    def ordered(self, files):
+        """The annotations of the given files that have one, in that order."""
+        return [self._annotations[f] for f in files if f in self._annotations]
+
+    def set(self, annotation):
+        """Add or replace the annotation of annotation.file. Clears the redo history."""
+        self._swap(annotation.file, annotation, self._undo)
+        self._redo.clear()
+
+    def remove(self, file):
+        if file in self._annotations:
+            self._swap(file, None, self._undo)
+            self._redo.clear()
+
+    def undo(self):
+        """Revert the last change and return the file it touched (None if there is nothing to undo)."""
+        if not self._undo:
+            return None
+        file, previous = self._undo.pop()
+        self._swap(file, previous, self._redo)
+        return file
+
+    def redo(self):
+        """Reapply the last undone change and return its file (None if there is nothing to redo)."""
+        if not self._redo:
+            return None
+        file, annotation = self._redo.pop()
+        self._swap(file, annotation, self._undo)
+        return file
+
+    def save(self, path):
+        """Write the annotations (not the undo history) to a JSON file."""
+        with open(path, "w") as f:
+            json.dump([annotation.to_dict() for annotation in self._annotations.values()], f)
+
+    @classmethod
+    def load(cls, path):
+        store = cls()
+        with open(path) as f:
+            for data in json.load(f):
+                annotation = Annotation.from_dict(data)
+                store._annotations[annotation.file] = annotation
+        return store
+
+    def _swap(self, file, annotation, history):
+        # Store annotation (or drop the file for None) and push what it replaced onto history.
+        history.append((file, self._annotations.get(file)))
+        if annotation is None:
+            self._annotations.pop(file, None)
+        else:
+            self._annotations[file] = annotation
@@ -0,0 +1,146 @@
+# Parameter-sweep calibration of brightness, min_area, max_area and cluster_max.
+#
+# Every annotated sample image is decoded once and its main ROI (the first one)
+# is counted on its first channel. For each brightness the mask and its contours
+# are computed once as well; every (min_area, max_area, cluster_max) combination
+# is then counted from that contour table with array arithmetic. Images are
+# spread over worker processes by the memory-aware scheduler.
+#
+#     python -m cellcount.calibration "Pics" annotations.json --bright 140 160 180 200 \
+#         --min-area 20 40 60 --max-area 600 900 1200 --truth truth.csv --output calibration.csv
+
+import argparse
+import csv
+import itertools
+from collections import namedtuple
+from os.path import join
+
+from cellcount.annotations import AnnotationStore
+from cellcount.counting import MAX_AREA, contour_table, contrast_filter, count_table
+from cellcount.images import PROJECTIONS, load_roi, probe_image
+from cellcount.scheduler import CountJob, schedule
+
+
+# One point of the parameter grid.
+Parameters = namedtuple("Parameters", ["bright", "min_area", "max_area", "cluster_max"])
+
+# Counts of one parameter set over the sample: per-image (left, right) keyed by
+# file, totals and, when ground truth was given, the mean absolute error of the
+# left and right counts over the images that have a manual count.
+Calibration = namedtuple("Calibration", ["parameters", "counts", "left", "right", "error"])
+
+
+def parameter_grid(brights, min_areas=(40,), max_areas=(MAX_AREA,), cluster_maxes=(10000,)):
+    return [Parameters(*values) for values in itertools.product(brights, min_areas, max_areas, cluster_maxes)]
+
+
+def calibrate_job(job, grid):
+    """Count one image with every Parameters in grid; return {Parameters: (left, right)}. Runs in a worker."""
+    annotation = job.annotation
+    roi = next(iter(annotation.rois.values()))
+    channel = annotation.channels[0].name
+    bits = job.bits if job.bits is not None else probe_image(job.path).significant_bits
+    cropped_image = load_roi(job.path, annotation.rotations, roi, job.projection)
+    x1, y1, x2, y2 = roi
+    middle = (x2 - x1) / 2
+
+    counts = {}
+    for bright in sorted(set(parameters.bright for parameters in grid)):
+        areas, xs = contour_table(contrast_filter(cropped_image, bright, channel, bits))
+        for parameters in grid:
+            if parameters.bright == bright:
+                counts[parameters] = count_table(areas, xs, middle, parameters.min_area,
+                                                 parameters.cluster_max, parameters.max_area)
+    return counts
+
+
+def read_truth(path):
+    """Manual counts from a CSV file with "file", "left" and "right" columns: {file: (left, right)}."""
+    with open(path, newline="") as f:
+        return {row["file"]: (int(row["left"]), int(row["right"])) for row in csv.DictReader(f)}
+
+
+def calibrate(folder, annotations, grid, truth=None, projection="max", memory_budget=None, max_workers=None,
+              bits=None):
+    """Count every annotation in folder with every point of grid.
+
+    bits overrides the significant bits per sample read from the file headers.
+    Returns a Calibration per Parameters, sorted by error (when truth is given)
+    and otherwise in grid order.
+    """
+    jobs = [CountJob(join(folder, annotation.file), annotation, projection, bits) for annotation in annotations]
+    per_image = schedule(calibrate_job, jobs, (grid,), memory_budget, max_workers)
+
+    calibrations = []
+    for parameters in grid:
+        counts = {job.annotation.file: image[parameters] for job, image in zip(jobs, per_image)}
+        error = None
+        if truth:
+            diffs = [(abs(left - truth[file][0]) + abs(right - truth[file][1])) / 2
+                     for file, (left, right) in counts.items() if file in truth]
+            error = sum(diffs) / len(diffs) if diffs else None
+        calibrations.append(Calibration(parameters, counts,
+                                        sum(left for left, right in counts.values()),
+                                        sum(right for left, right in counts.values()), error))
+
+    if truth:
+        calibrations.sort(key=lambda calibration: float("inf") if calibration.error is None else calibration.error)
+    return calibrations
+
+
+def write_report(path, calibrations, truth=None):
+    """One CSV row per (parameter set, image)."""
+    truth = truth or {}
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(list(Parameters._fields) + ["file", "left", "right", "true_left", "true_right"])
+        for calibration in calibrations:
+            for file, (left, right) in calibration.counts.items():
+                true_left, true_right = truth.get(file, ("", ""))
+                writer.writerow(list(calibration.parameters) + [file, left, right, true_left, true_right])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Count a sample of annotated images with a grid of counting parameters.")
+    parser.add_argument("pics", help="folder with the large TIFF images")
+    parser.add_argument("annotations", help="annotations saved by EasyCellCounting.py --save-annotations")
+    parser.add_argument("--bright", type=int, nargs="+", default=[160, 200, 250],
+                        help="brightness values in the native units of the images (e.g. 2560 for 160 on 12-bit data, 40960 on 16-bit)")
+    parser.add_argument("--min-area", type=int, nargs="+", default=[40])
+    parser.add_argument("--max-area", type=int, nargs="+", default=[MAX_AREA])
+    parser.add_argument("--cluster-max", type=int, nargs="+", default=[10000])
+    parser.add_argument("--sample", type=int, default=None, metavar="N", help="only use N evenly spaced annotated images")
+    parser.add_argument("--truth", help='CSV file of manual counts with "file", "left" and "right" columns')
+    parser.add_argument("--output", help="write the per-image counts of every parameter set to this CSV file")
+    parser.add_argument("--projection", choices=PROJECTIONS, default="max")
+    parser.add_argument("--memory-budget", type=float, default=None, metavar="GB")
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--bits", type=int, default=None,
+                        help="significant bits per sample of the images (default: read from the TIFF tags)")
+    args = parser.parse_args(argv)
+
+    store = AnnotationStore.load(args.annotations)
+    annotations = [store[file] for file in sorted(store.files())]
+    if args.sample and args.sample < len(annotations):
+        step = len(annotations) / args.sample
+        annotations = [annotations[int(i * step)] for i in range(args.sample)]
+
+    truth = read_truth(args.truth) if args.truth else None
+    grid = parameter_grid(args.bright, args.min_area, args.max_area, args.cluster_max)
+    memory_budget = None if args.memory_budget is None else int(args.memory_budget * 1024 ** 3)
+    calibrations = calibrate(args.pics, annotations, grid, truth, args.projection, memory_budget, args.workers,
+                             args.bits)
+
+    print("bright  min_area  max_area  cluster_max  left  right" + ("  error" if truth else ""))
+    for calibration in calibrations:
+        line = "{:6}  {:8g}  {:8g}  {:11g}  {:4}  {:5}".format(*calibration.parameters, calibration.left, calibration.right)
+        if truth:
+            line += "  " + ("-" if calibration.error is None else "{:.2f}".format(calibration.error))
+        print(line)
+
+    if args.output:
+        write_report(args.output, calibrations, truth)
+
+
+if __name__ == "__main__":
+    main()
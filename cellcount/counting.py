@@ -0,0 +1,224 @@
+# The counting stage: contrast filter, contour counting and the cluster algorithm.
+#
+# cellcount/regression.py keeps a frozen copy of the original per-pixel
+# implementation; any change here must keep its counts identical.
+
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from cellcount.images import channel_plane, to_bgr8
+
+
+# The max area constant can be approximated by the user after a few trail images are counted. 
+MAX_AREA = 900
+
+# Thresholding modes: "fixed" uses the brightness set for the image, "auto"
+# subtracts the estimated background and picks an Otsu threshold per ROI.
+THRESHOLDS = ("fixed", "auto")
+
+# The background of the automatic threshold is estimated on the counted channel
+# shrunk by BACKGROUND_SCALE, opened with a disc of BACKGROUND_KERNEL pixels
+# (about 120 full-resolution pixels, wider than a cluster, so cells disappear)
+# and scaled back up.
+BACKGROUND_SCALE = 8
+BACKGROUND_KERNEL = 15
+
+# Lowest automatic threshold above background (in 8-bit units, scaled to the
+# significant bits of the image), so an ROI without cells does not get its noise split in two.
+MIN_AUTO_LEVEL = 16
+
+# left / right are the final counts for the ROI. clusters lists ("left" | "right", n)
+# for every cluster that was split into n cells. objects lists a CountedObject
+# for every contour that was counted. overlay is the ROI with counted cells drawn
+# in green and clusters in blue (or None when it was not kept).
+CountResult = namedtuple("CountResult", ["left", "right", "clusters", "objects", "overlay"])
+
+# A counted contour: centre of its enclosing circle, its area, how many cells it
+# counts for (1, or the cluster estimate) and its side ("left", "right" or None
+# when it sits exactly on the middle and is not counted).
+CountedObject = namedtuple("CountedObject", ["x", "y", "area", "cells", "side"])
+
+
+def _sample_bits(dtype, bits=None):
+    # Significant bits of integer samples: bits if given, else the whole dtype
+    return bits if bits is not None else 8 * np.dtype(dtype).itemsize
+
+
+def _saturation(dtype, bits=None):
+    return (1 << _sample_bits(dtype, bits)) - 1 if np.issubdtype(dtype, np.integer) else np.inf
+
+
+def contrast_filter(cropped_image, bright, channel="red", bits=None):
+    """Return a mask that is 255 where the counted channel is in [bright, saturation) and 0 elsewhere.
+
+    bright is in the native units of the image (0-255 for 8-bit, 0-4095 for
+    12-bit, 0-65535 for 16-bit) and saturation is the largest value of bits
+    significant bits (default: of the dtype). channel names the plane that is
+    counted (see images.CHANNELS).
+    """
+    red = channel_plane(cropped_image, channel)
+    # Same range as the original per-pixel filter: range(bright, 255) leaves out 255 itself
+    mask = (red >= bright) & (red < _saturation(red.dtype, bits))
+    return mask.view(np.uint8) * np.uint8(255)
+
+
+def estimate_background(channel, scale=BACKGROUND_SCALE, kernel=BACKGROUND_KERNEL):
+    """Smooth background level of a single-channel image, at full size."""
+    height, width = channel.shape
+    small = cv2.resize(channel, (max(width // scale, 1), max(height // scale, 1)), interpolation=cv2.INTER_AREA)
+    disc = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (kernel, kernel))
+    small = cv2.morphologyEx(small, cv2.MORPH_OPEN, disc)
+    return cv2.resize(small, (width, height), interpolation=cv2.INTER_LINEAR)
+
+
+def otsu_level(values):
+    """Otsu's threshold of an array of non-negative integers: foreground is values > level."""
+    hist = np.bincount(values.ravel()).astype(np.float64)
+    levels = np.arange(len(hist))
+    below = np.cumsum(hist)
+    below_sum = np.cumsum(hist * levels)
+    above = below[-1] - below
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # Between-class variance (times a constant) for every split point
+        between = (below_sum[-1] * below - below_sum * below[-1]) ** 2 / (below * above)
+    return int(np.argmax(np.nan_to_num(between, nan=0.0, posinf=0.0)))
+
+
+def auto_threshold_filter(cropped_image, min_level=MIN_AUTO_LEVEL, channel="red", bits=None):
+    """Return a mask that is 255 where the background-corrected channel is above its Otsu level.
+
+    min_level is in 8-bit units and scaled to bits significant bits (default: of the dtype).
+    """
+    red = channel_plane(cropped_image, channel)
+    corrected = cv2.subtract(red, estimate_background(red))
+    if np.issubdtype(red.dtype, np.integer):
+        min_level = min_level << max(_sample_bits(red.dtype, bits) - 8, 0)
+    level = max(otsu_level(corrected), min_level)
+    return (corrected > level).view(np.uint8) * np.uint8(255)
+
+
+def count_contours(img, min_area, cluster_max, max_area=MAX_AREA, middle=None, overlay=None):
+    """Count the contours of mask img on each side of middle (default: half its width).
+
+    If overlay is given, counted cells are drawn onto it in green and clusters in blue.
+    """
+    # Identifying the middle to later sort counts into left / right arrays
+    if middle is None:
+        middle = img.shape[1] / 2
+    
+    # Finding countours of potential cells to count: 
+    cnts = cv2.findContours(img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    cnts = cnts[0] if len(cnts) == 2 else cnts[1]
+    
+    left = 0
+    right = 0
+    clusters = []
+    objects = []
+    area_list = []
+
+    def side_of(x):
+        if x < middle:
+            return "left"
+        elif x > middle:
+            return "right"
+        return None
+    
+    # Counting with OpenCV Countour function
+    for c in cnts:
+        area = cv2.contourArea(c)
+        if area > min_area and area < max_area:
+            # Drawing green countour over counted cells: 
+            if overlay is not None:
+                cv2.drawContours(overlay, [c], -1, (0, 250, 0), 2)
+            # Extracting useful information about the location of each countour in coordinates:
+            (x,y),radius = cv2.minEnclosingCircle(c)
+            # Sorting which cells are on the left and right side of the middle: 
+            side = side_of(x)
+            if side == "left":
+                left += 1
+            elif side == "right":
+                right += 1
+            objects.append(CountedObject(x, y, area, 1, side))
+            area_list.append(area)
+    
+    # CLUSTER ALGORITHM:
+    if len(area_list) > 3: # Requires at least 3 normal cells to be present in the image
+        Biggest_Cell_area = np.percentile(area_list, 99)
+
+        for c1 in cnts:
+            area = cv2.contourArea(c1)
+            if area > max_area and area < cluster_max:
+                # Drawing a blue contour around identified clusters of cells: 
+                if overlay is not None:
+                    cv2.drawContours(overlay, [c1], -1, (250, 0, 0), 2)
+                (x,y),radius = cv2.minEnclosingCircle(c1)
+                # Check stores the minimum number of cells within the identified clusters:
+                check = int((area / Biggest_Cell_area) + 1)
+                
+                # Adding the cluster counts to each respective side:
+                side = side_of(x)
+                if side == "left":
+                    left += check
+                    clusters.append(("left", check))
+                elif side == "right":
+                    right += check
+                    clusters.append(("right", check))
+                objects.append(CountedObject(x, y, area, check, side))
+
+    return CountResult(left, right, clusters, objects, overlay)
+
+
+def count_cells(cropped_image, bright, min_area, cluster_max, max_area=MAX_AREA, middle=None, threshold="fixed",
+                overlay=True, channel="red", bits=None):
+    """Count cells on the left and right half of an ROI (single channel or BGR, any bit depth).
+
+    threshold is one of THRESHOLDS; bright is in native units and ignored for
+    "auto". middle defaults to half the ROI width and channel is the plane that
+    is counted (see images.CHANNELS). bits is the number of significant bits
+    of the samples (default: the whole dtype). With overlay, the result
+    carries an 8-bit BGR copy of the ROI with the counted contours drawn on it.
+    """
+    if threshold == "auto":
+        img = auto_threshold_filter(cropped_image, channel=channel, bits=bits)
+    elif threshold == "fixed":
+        img = contrast_filter(cropped_image, bright, channel, bits)
+    else:
+        raise ValueError("threshold must be one of " + ", ".join(THRESHOLDS) + ", not " + repr(threshold))
+    return count_contours(img, min_area, cluster_max, max_area, middle,
+                          overlay=to_bgr8(cropped_image, bits) if overlay else None)
+
+
+def contour_table(img):
+    """Area and enclosing-circle x of every contour of mask img, as two float arrays.
+
+    The table only depends on the mask, so it can be counted with many
+    (min_area, max_area, cluster_max) settings by count_table.
+    """
+    cnts = cv2.findContours(img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    cnts = cnts[0] if len(cnts) == 2 else cnts[1]
+    areas = np.array([cv2.contourArea(c) for c in cnts], dtype=np.float64)
+    xs = np.array([cv2.minEnclosingCircle(c)[0][0] for c in cnts], dtype=np.float64)
+    return areas, xs
+
+
+def count_table(areas, xs, middle, min_area, cluster_max, max_area=MAX_AREA):
+    """(left, right) of a contour_table, the same counts count_contours gives."""
+    left_side = xs < middle
+    right_side = xs > middle
+
+    cells = (areas > min_area) & (areas < max_area)
+    left = int(np.count_nonzero(cells & left_side))
+    right = int(np.count_nonzero(cells & right_side))
+
+    # CLUSTER ALGORITHM:
+    if np.count_nonzero(cells) > 3: # Requires at least 3 normal cells to be present in the image
+        Biggest_Cell_area = np.percentile(areas[cells], 99)
+        clusters = (areas > max_area) & (areas < cluster_max)
+        # int() of the positive cluster estimate, as in count_contours
+        checks = (areas / Biggest_Cell_area + 1).astype(np.int64)
+        left += int(checks[clusters & left_side].sum())
+        right += int(checks[clusters & right_side].sum())
+
+    return left, right
@@ -0,0 +1,108 @@
+# Writing the left / right counts into the Excel workbook and color coding them.
+#
+# The tables are built from a cellcount.summary results frame; openpyxl (and
+# pandas) are only imported when a workbook is written.
+
+
+# Sections from different regions of the brain / spinal cord carry one of these
+# codes in their file name; the first code found picks the highlight color.
+REGION_COLORS = {
+    "A1": 27, "A2": 44, "A3": 49, "A4": 4,
+    "B1": 5, "B2": 50, "B3": 57, "B4": 19,
+    "C1": 45, "C2": 29, "C3": 22, "C4": 23,
+}
+
+# The right counts table starts this many rows below the left counts table
+RIGHT_TABLE_OFFSET = 35
+
+# Row of the color code legend
+LEGEND_ROW = 90
+
+
+def region_color(file_name):
+    for region, color in REGION_COLORS.items():
+        if region in file_name:
+            return color
+    return None
+
+
+def _cell_value(value):
+    # openpyxl cannot store NaN (an animal without that section) or numpy scalars
+    if value is None or value != value:
+        return None
+    return value.item() if hasattr(value, "item") else value
+
+
+def _write_frame(sheet, frame):
+    sheet.append(list(frame.columns))
+    for row in frame.itertuples(index=False):
+        sheet.append([_cell_value(value) for value in row])
+
+
+def write_counts(frame, input_path="input.xlsx", output_path="cell_counts.xlsx", roi="roi", channel="red"):
+    """Fill the left / right tables of the blank workbook at input_path and save it to output_path.
+
+    frame is a summary.results_frame. The tables have a row per animal and a
+    column per section (and region, when one section has several), for one
+    ROI and channel (the main ROI and red channel by default). channel can
+    also be a dict of the channel to take from each file, as in
+    summary.section_table. The per-animal totals and per-region means of
+    every ROI / channel go on sheets of their own.
+    """
+    import openpyxl
+    from openpyxl.styles import PatternFill
+    from openpyxl.styles.colors import Color
+
+    from cellcount.summary import animal_totals, region_means, section_table
+
+    obj = openpyxl.load_workbook(input_path)
+    sheet = obj.active
+
+    def fill(row, column, color):
+        sheet.cell(row = row, column = column).fill = PatternFill(patternType='solid', fgColor=Color(indexed=color))
+
+    left = section_table(frame, "left", roi, channel)
+    right = section_table(frame, "right", roi, channel).reindex(index=left.index, columns=left.columns)
+
+    # The tables and the legend move down when there are more animals than fit above them
+    right_offset = max(RIGHT_TABLE_OFFSET, len(left) + 3)
+    legend_row = max(LEGEND_ROW, right_offset + len(right) + 4)
+
+    sheet.cell(row = 1, column = 1).value = "Left Counts (NEED TO CHECK BLUE DYE)"
+    sheet.cell(row = 1 + right_offset, column = 1).value = "Right Counts (NEED TO CHECK BLUE DYE)"
+
+    # One column per section number, followed by the region code if it has one
+    for column, (section, region) in enumerate(left.columns, start=2):
+        header = _cell_value(section) if not region else str(section) + " " + region
+        sheet.cell(row = 2, column = column).value = header
+        sheet.cell(row = 2 + right_offset, column = column).value = header
+
+    # One row per animal
+    for r, animal in enumerate(left.index, start=3):
+        sheet.cell(row = r, column = 1).value = animal
+        sheet.cell(row = r + right_offset, column = 1).value = animal
+
+        for c in range(len(left.columns)):
+            # Add the left count to the top table and the right count to the bottom table
+            sheet.cell(row = r, column = c + 2).value = _cell_value(left.iat[r - 3, c])
+            sheet.cell(row = r + right_offset, column = c + 2).value = _cell_value(right.iat[r - 3, c])
+
+            # Color coding (via highlighting) by the A1 - C4 code in the file name:
+            color = REGION_COLORS.get(left.columns[c][1])
+            if color is not None and left.iat[r - 3, c] == left.iat[r - 3, c]:
+                fill(r, c + 2, color)
+                fill(r + right_offset, c + 2, color)
+
+    # Display the color code on the legend row of the Excel document
+    sheet.cell(row = legend_row, column = 1).value = "Color code: "
+    for column, (region, color) in enumerate(REGION_COLORS.items(), start=2):
+        sheet.cell(row = legend_row, column = column).value = region
+        fill(legend_row, column, color)
+
+    # Grouped summaries of every ROI and channel
+    for title, summary in (("Per animal", animal_totals(frame)), ("Per region", region_means(frame))):
+        if title in obj.sheetnames:
+            del obj[title]
+        _write_frame(obj.create_sheet(title), summary.reset_index())
+
+    obj.save(filename=output_path)
@@ -0,0 +1,37 @@
+# Listing and ordering the image files of a folder.
+
+from os import listdir
+from os.path import isfile, join
+
+
+# The insertionSort function performs insertion sort to organize files in sequential (ascending) order
+
+def insertionSort(arr1, arr2):
+     
+    if (n := len(arr1)) <= 1:
+        return
+    
+    for i in range(1, n):
+         
+        key1 = arr1[i]
+        key2 = arr2[i]
+        m = i-1
+        while m >=0 and key1 < arr1[m] :
+                arr1[m+1] = arr1[m]
+                arr2[m+1] = arr2[m]
+                m -= 1
+        arr1[m+1] = key1
+        arr2[m+1] = key2
+        # Sorts through each file one-by-one by looking at the NAMES of each file.
+        # The "<" operation forces the program to look for the first different character in the names of the file.
+        # One can use this fact to name all files the same format except for certain numbers (to demarcate order)
+        # For example, when comparing "Zymo6 3730.4 1-12_s1.tif" and "Zymo6 3730.4 1-12_s2.tif", the program will place "Zymo6 3730.4 1-12_s1.tif" first in the onlyfiles array.
+        # This is due to naming of "s1" (in this case, "s1" means sample #1).
+
+
+def list_images(folder):
+    """Names of the files in folder, in the order they are counted."""
+    onlyfiles = [ f for f in listdir(folder) if isfile(join(folder,f)) ]
+    files = list(onlyfiles)
+    insertionSort(files, onlyfiles)
+    return onlyfiles
@@ -0,0 +1,331 @@
+# Image loading helpers shared by the interactive loop and the counting workers.
+#
+# Images are kept at their native bit depth and channel count: single-channel
+# files stay 2-D, colour files are BGR(A) as OpenCV reads them. Only display
+# and overlays are converted to 8-bit BGR (to_bgr8).
+#
+# Multi-page (z-stack) TIFFs are read one page at a time through PIL and
+# projected onto a single image before counting. Pages that are not z planes
+# (thumbnails, reduced-resolution copies) are skipped, and the interleaved
+# channels of ImageJ hyperstacks are projected separately, over z (and time)
+# only. PIL is only imported when a header is probed or a stack is read.
+# PIL reduces 16-bit colour samples to 8 bits, so 16-bit colour stacks are
+# read through tifffile instead (and cannot be read without it).
+
+import re
+from collections import namedtuple
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+
+
+# Header information about an image file, read without decoding its pixels.
+# pages is the number of pages of a TIFF and 1 for everything else. For an
+# ImageJ hyperstack (hyperstack=True) channels is the number of interleaved
+# channels, which become the planes of the projected image. bits is the size
+# of a stored sample and significant_bits how many of them the camera used
+# (12 for 12-bit data stored as 0 - 4095 in 16-bit samples); probe_image
+# always sets it.
+ImageHeader = namedtuple("ImageHeader",
+                         ["path", "width", "height", "channels", "bits", "pages", "hyperstack", "significant_bits"],
+                         defaults=[False, None])
+
+# Bits per sample for the PIL modes that show up in section scans.
+_MODE_BITS = {"1": 1, "I;16": 16, "I;16B": 16, "I;16L": 16, "I;16N": 16, "I": 32, "F": 32}
+
+# How the pages of a z-stack are combined: per-pixel maximum, sum (clipped to
+# the sample range) or mean.
+PROJECTIONS = ("max", "sum", "mean")
+
+# Planes of a colour (BGR) image that can be counted, by name. Single-channel
+# images only have one plane, which is counted as "red" (or "gray"). The
+# channels of an ImageJ hyperstack are named "c1", "c2", ... in file order.
+CHANNELS = {"blue": 0, "green": 1, "red": 2}
+
+# NewSubfileType bit of reduced-resolution pages.
+_REDUCED_RESOLUTION = 1
+
+# TIFF tags that give the significant bits of a sample.
+_BITS_PER_SAMPLE = 258
+_SMAX_SAMPLE_VALUE = 341
+
+
+# This function rotates an image given an angle and an input image
+def rotate_image(image, angle):
+    Center = tuple(np.array(image.shape[1::-1]) / 2)
+    Matrix = cv2.getRotationMatrix2D(Center, angle, 1.0)
+    # Utilizes openCV rotation Matrix function to rotate images 
+    rotated_image = cv2.warpAffine(image, Matrix, image.shape[1::-1], flags=cv2.INTER_LINEAR)
+    return rotated_image
+
+
+@contextmanager
+def _open(path):
+    from PIL import Image
+
+    # Big TIFF sections are well past PIL's decompression-bomb limit, which is
+    # only checked when the file is opened, so lift it for the open alone.
+    limit = Image.MAX_IMAGE_PIXELS
+    Image.MAX_IMAGE_PIXELS = None
+    try:
+        image = Image.open(path)
+    finally:
+        Image.MAX_IMAGE_PIXELS = limit
+    with image:
+        yield image
+
+
+def _imagej_channels(image):
+    # Number of interleaved channels declared in an ImageJ description (1 if none)
+    description = getattr(image, "tag_v2", {}).get(270)
+    if not isinstance(description, str) or not description.startswith("ImageJ="):
+        return 1
+    match = re.search(r"^channels=(\d+)", description, re.MULTILINE)
+    return int(match.group(1)) if match else 1
+
+
+def _sample_bits(image):
+    # PIL opens 16-bit colour files in 8-bit "RGB" mode, so the stored size comes
+    # from BitsPerSample (TIFF) or the raw mode of the decoder (PNG)
+    bits = _MODE_BITS.get(image.mode, 8)
+    stored = getattr(image, "tag_v2", {}).get(_BITS_PER_SAMPLE)
+    if isinstance(stored, tuple):
+        stored = max(stored) if stored else None
+    if isinstance(stored, int) and stored > bits:
+        return -(-stored // 8) * 8
+    rawmode = getattr(getattr(image, "png", None), "im_rawmode", "")
+    if ";16" in rawmode:
+        return max(bits, 16)
+    return bits
+
+
+def _significant_bits(image, bits):
+    # SMaxSampleValue, else BitsPerSample when it is less than the sample size (bits if neither)
+    tags = getattr(image, "tag_v2", {})
+    for tag, to_bits in ((_SMAX_SAMPLE_VALUE, int.bit_length), (_BITS_PER_SAMPLE, int)):
+        value = tags.get(tag)
+        if isinstance(value, tuple):
+            value = max(value) if value else None
+        if isinstance(value, int) and 0 < to_bits(value) < bits:
+            return max(to_bits(value), 8)
+    return bits
+
+
+def probe_image(path):
+    """Read the dimensions, bit depth and page count of an image from its header only."""
+    with _open(path) as image:
+        width, height = image.size
+        channels = len(image.getbands())
+        bits = _sample_bits(image)
+        pages = getattr(image, "n_frames", 1)
+        hyperstack = False
+        if pages > 1 and channels == 1 and _imagej_channels(image) > 1:
+            channels, hyperstack = _imagej_channels(image), True
+        significant_bits = _significant_bits(image, bits)
+    return ImageHeader(path, width, height, channels, bits, pages, hyperstack, significant_bits)
+
+
+def decoded_bytes(header):
+    """Bytes held by the array that load_image returns for this file."""
+    # Native depth, and alpha is dropped by IMREAD_ANYCOLOR
+    return header.width * header.height * min(header.channels, 3) * max(header.bits, 8) // 8
+
+
+def page_bytes(header):
+    """Bytes of one page of the file in its native format."""
+    return header.width * header.height * header.channels * max(header.bits, 8) // 8
+
+
+def stack_channels(path):
+    """None if path is not a multi-page TIFF, else the number of interleaved channels of its pages (usually 1)."""
+    if not str(path).lower().endswith((".tif", ".tiff")):
+        return None
+    header = probe_image(path)
+    if header.pages < 2:
+        return None
+    return header.channels if header.hyperstack else 1
+
+
+def channel_names(header):
+    """Names of the planes channel_plane finds in the image of header (see CHANNELS)."""
+    if header.hyperstack:
+        return tuple("c" + str(i) for i in range(1, header.channels + 1))
+    if header.channels >= 3:
+        # The alpha plane is dropped when the image is read
+        return tuple(CHANNELS) + ("c1", "c2", "c3")
+    return ("red", "gray")
+
+
+def native_brightness(bright, bits):
+    """Convert an 8-bit brightness (like the 160 / 200 / 250 presets) to the native units of a bits-deep image."""
+    return bright << (max(bits, 8) - 8)
+
+
+def channel_plane(image, channel="red"):
+    """The named plane of an image (see CHANNELS), as a view; a single-channel image is its own red plane."""
+    if image.ndim == 2:
+        if channel not in ("red", "gray"):
+            raise ValueError("Single-channel image has no " + repr(channel) + " channel")
+        return image
+    match = re.fullmatch(r"c(\d+)", channel)
+    if match and 1 <= int(match.group(1)) <= image.shape[2]:
+        return image[:, :, int(match.group(1)) - 1]
+    if channel not in CHANNELS:
+        raise ValueError("channel must be one of " + ", ".join(CHANNELS) + ", not " + repr(channel))
+    if image.shape[2] != 3:
+        # Hyperstack planes have no colours, only numbers
+        raise ValueError(str(image.shape[2]) + "-channel image has no " + repr(channel) + " channel, use c1, c2...")
+    return image[:, :, CHANNELS[channel]]
+
+
+def load_image(path):
+    image = cv2.imread(path, cv2.IMREAD_ANYDEPTH | cv2.IMREAD_ANYCOLOR)
+    if image is None:
+        raise IOError("Could not read image " + str(path))
+    return image
+
+
+def iter_pages(path):
+    """Yield the pages of a (multi-page) image as arrays, decoding one page at a time.
+
+    Pages of another size or sample format than the first one, and pages
+    marked as reduced-resolution copies, are not image planes and are skipped.
+    16-bit colour pages are read at their native depth through tifffile.
+    """
+    with _open(path) as image:
+        if len(image.getbands()) > 1 and _sample_bits(image) > 8:
+            yield from _iter_deep_colour_pages(path)
+            return
+        first = (image.size, image.mode)
+        for page in range(getattr(image, "n_frames", 1)):
+            image.seek(page)
+            subfile_type = getattr(image, "tag_v2", {}).get(254, 0)
+            if (image.size, image.mode) != first or (page and subfile_type & _REDUCED_RESOLUTION):
+                continue
+            yield _rgb_to_bgr(np.asarray(image))
+
+
+def _iter_deep_colour_pages(path):
+    # Same page selection as iter_pages, for the colour samples PIL would reduce to 8 bits
+    try:
+        import tifffile
+    except ImportError:
+        raise IOError("Reading the 16-bit colour stack " + str(path) + " needs tifffile") from None
+    with tifffile.TiffFile(path) as tiff:
+        first = None
+        for page in tiff.pages:
+            if first is None:
+                first = (page.shape, page.dtype)
+            elif (page.shape, page.dtype) != first or page.subfiletype & _REDUCED_RESOLUTION:
+                continue
+            yield _rgb_to_bgr(page.asarray())
+
+
+def _rgb_to_bgr(array):
+    # PIL and tifffile give colour pages in RGB(A) order; keep OpenCV's BGR layout
+    if array.ndim == 3 and array.shape[2] == 3:
+        return cv2.cvtColor(array, cv2.COLOR_RGB2BGR)
+    if array.ndim == 3 and array.shape[2] == 4:
+        return cv2.cvtColor(array, cv2.COLOR_RGBA2BGR)
+    return array
+
+
+def project_pages(pages, projection="max", box=None, channels=1):
+    """Combine pages into one array of the same dtype, cropping each page to box first.
+
+    With channels > 1 the pages hold that many interleaved channels (ImageJ
+    hyperstack order); each channel is projected on its own and the result has
+    one plane per channel. Only the current page and the running results are
+    held in memory.
+    """
+    if projection not in PROJECTIONS:
+        raise ValueError("projection must be one of " + ", ".join(PROJECTIONS) + ", not " + repr(projection))
+
+    results = [None] * channels
+    counts = [0] * channels
+    for index, page in enumerate(pages):
+        if box is not None:
+            x1, y1, x2, y2 = box
+            page = page[y1:y2, x1:x2]
+        channel = index % channels
+        result = results[channel]
+        if result is None:
+            dtype = page.dtype
+            results[channel] = page.astype(dtype if projection == "max" else np.float64)
+        elif result.shape != page.shape:
+            raise IOError("Pages of different shapes cannot be projected: " + str(result.shape) + " and "
+                          + str(page.shape))
+        elif projection == "max":
+            np.maximum(result, page, out=result)
+        else:
+            result += page
+        counts[channel] += 1
+
+    if any(result is None for result in results):
+        raise IOError("Image has no pages" if results[0] is None else "Image has fewer pages than channels")
+    if projection != "max":
+        for result, count in zip(results, counts):
+            if projection == "mean":
+                result /= count
+            if np.issubdtype(dtype, np.integer):
+                info = np.iinfo(dtype)
+                np.clip(np.rint(result, out=result), info.min, info.max, out=result)
+        results = [result.astype(dtype) for result in results]
+    return results[0] if channels == 1 else np.dstack(results)
+
+
+def to_bgr8(array, bits=None):
+    """Convert a native image (gray or BGR, 8 or 16 bit) to 8-bit BGR for display and overlays.
+
+    This is what cv2.imread returns with its default flags. With bits (the
+    significant bits of the samples, e.g. 12) the top 8 of those are kept
+    instead, so 12-bit data is not shown almost black. The channels of a
+    projected hyperstack are shown as the gray maximum over them.
+    """
+    if bits is not None and array.dtype == np.uint16 and bits < 16:
+        array = np.minimum(array >> max(bits - 8, 0), 255).astype(np.uint8)
+    elif array.dtype == np.uint16:
+        # cv2.imread keeps the high byte of 16-bit samples
+        array = (array >> 8).astype(np.uint8)
+    elif array.dtype != np.uint8:
+        array = cv2.convertScaleAbs(array)
+    if array.ndim == 3 and array.shape[2] != 3:
+        array = array.max(axis=2)
+    if array.ndim == 2:
+        return cv2.cvtColor(array, cv2.COLOR_GRAY2BGR)
+    return array.copy()
+
+
+def load_rois(path, rotations, rois, projection="max"):
+    """Decode an image once, replay the user's rotations and return a copy of every ROI.
+
+    rois is a list of (x1, y1, x2, y2) boxes in full-resolution pixels. The
+    copies let the full image be freed before counting starts. Multi-page TIFFs
+    are projected with projection (see PROJECTIONS) while their pages are
+    streamed. The ROIs keep the native bit depth and channels of the file.
+    """
+    channels = stack_channels(path)
+    if channels is not None:
+        if not rotations:
+            # Cropping before projecting gives the same pixels and only keeps
+            # the box around all ROIs
+            box = (min(roi[0] for roi in rois), min(roi[1] for roi in rois),
+                   max(roi[2] for roi in rois), max(roi[3] for roi in rois))
+            image = project_pages(iter_pages(path), projection, box, channels)
+            return [image[y1 - box[1]:y2 - box[1], x1 - box[0]:x2 - box[0]].copy() for x1, y1, x2, y2 in rois]
+        # Rotations were chosen on a projected preview, so project the whole
+        # page first, exactly as if the stack had been projected in another tool
+        image = project_pages(iter_pages(path), projection, channels=channels)
+    else:
+        image = load_image(path)
+    # Rotations are replayed one at a time (not summed) so the result matches
+    # the preview the box was drawn on.
+    for angle in rotations:
+        image = rotate_image(image, angle)
+    return [image[y1:y2, x1:x2].copy() for x1, y1, x2, y2 in rois]
+
+
+def load_roi(path, rotations, roi, projection="max"):
+    """Decode an image, replay the user's rotations and return a copy of the ROI (see load_rois)."""
+    return load_rois(path, rotations, [roi], projection)[0]
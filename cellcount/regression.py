@@ -0,0 +1,239 @@
+# Golden-result regression harness for the counting stage.
+#
+# reference_count is a frozen copy of the original per-pixel threshold +
+# findContours + int(area / p99 + 1) cluster algorithm. Every faster path in
+# cellcount/counting.py has to give exactly the same left / right counts; when
+# it does not, the objects that differ are reported. The comparison runs on
+# 8-bit BGR images, the only input the original algorithm handled.
+#
+#     python -m cellcount.regression --synthetic 200
+#     python -m cellcount.regression "Pics" --bright 160 200 250 --workers 4
+
+import argparse
+import sys
+from collections import Counter, namedtuple
+from concurrent.futures import ProcessPoolExecutor
+from os.path import join
+
+import cv2
+import numpy as np
+
+from cellcount.counting import CountedObject, CountResult, count_cells
+from cellcount.files import list_images
+from cellcount.images import load_image, to_bgr8
+
+
+# The brightness presets of the interactive loop ("t", "v" and "p" keys).
+PRESET_BRIGHTS = (160, 200, 250)
+
+# name identifies the image, expected / actual are (left, right) of the reference
+# and of the tested implementation, missing / extra are the CountedObjects only
+# the reference / only the tested implementation found.
+Mismatch = namedtuple("Mismatch", ["name", "bright", "expected", "actual", "missing", "extra"])
+
+
+def reference_count(cropped_image, bright, min_area, cluster_max, max_area=900, middle=None):
+    """The original counting stage, pixel loop and all. Do not optimise this function."""
+    import PIL.Image
+
+    cropped_image = cropped_image.copy()
+    if middle is None:
+        middle = cropped_image.shape[1] / 2
+
+    # Converting the cropped image to RGB format to allow for PIL manipulations
+    color_coverted = cv2.cvtColor(cropped_image, cv2.COLOR_BGR2RGB)
+    image = PIL.Image.fromarray(color_coverted)
+    pix = image.load()
+
+    width, height = image.size
+
+    # Contrast filter: interating through each pixel of the cropped_image.
+    for y in range(height):
+        for x in range(width):
+            r = pix[x,y][0]
+            rng = range(bright, 255, 1)
+            if r in rng:
+                pix[x, y] = (255, 0, 0)
+            else:
+                pix[x, y] = (0, 0, 0)
+
+    cvimg = cv2.cvtColor(np.array(image), cv2.COLOR_RGB2BGR)
+
+    img = cv2.cvtColor(cvimg, cv2.COLOR_BGR2GRAY)
+
+    # Finding countours of potential cells to count:
+    cnts = cv2.findContours(img, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    cnts = cnts[0] if len(cnts) == 2 else cnts[1]
+
+    left_white_dots = []
+    right_white_dots = []
+    clusters = []
+    objects = []
+    area_list = []
+
+    for c in cnts:
+        area = cv2.contourArea(c)
+        if area > min_area and area < max_area:
+            cv2.drawContours(cropped_image, [c], -1, (0, 250, 0), 2)
+            (x,y),radius = cv2.minEnclosingCircle(c)
+            side = None
+            if x < middle:
+                left_white_dots.append(c)
+                side = "left"
+            elif x > middle:
+                right_white_dots.append(c)
+                side = "right"
+            objects.append(CountedObject(x, y, area, 1, side))
+            area_list.append(area)
+
+    # CLUSTER ALGORITHM:
+    if len(area_list) > 3: # Requires at least 3 normal cells to be present in the image
+        Biggest_Cell_area = np.percentile(area_list, 99)
+
+        for c1 in cnts:
+            area = cv2.contourArea(c1)
+            if area > max_area and area < cluster_max:
+                cv2.drawContours(cropped_image, [c1], -1, (250, 0, 0), 2)
+                (x,y),radius = cv2.minEnclosingCircle(c1)
+                check = int((area / Biggest_Cell_area) + 1)
+
+                side = None
+                if x < middle:
+                    for i in range(0, check):
+                        left_white_dots.append(c1)
+                    clusters.append(("left", check))
+                    side = "left"
+                elif x > middle:
+                    for i in range(0, check):
+                        right_white_dots.append(c1)
+                    clusters.append(("right", check))
+                    side = "right"
+                objects.append(CountedObject(x, y, area, check, side))
+
+    return CountResult(len(left_white_dots), len(right_white_dots), clusters, objects, cropped_image)
+
+
+def _object_key(obj):
+    # Coordinates are rounded so that harmless float noise does not show up as a diff
+    return (round(obj.x, 3), round(obj.y, 3), round(obj.area, 3), obj.cells, obj.side)
+
+
+def compare(cropped_image, bright, min_area=40, cluster_max=10000, name=None, count=count_cells):
+    """Count cropped_image with the reference and with count; return a Mismatch or None."""
+    expected = reference_count(cropped_image, bright, min_area, cluster_max)
+    actual = count(cropped_image.copy(), bright, min_area, cluster_max)
+    if (expected.left, expected.right) == (actual.left, actual.right):
+        return None
+
+    expected_objects = Counter(_object_key(obj) for obj in expected.objects)
+    actual_objects = Counter(_object_key(obj) for obj in actual.objects)
+    return Mismatch(name, bright, (expected.left, expected.right), (actual.left, actual.right),
+                    sorted((expected_objects - actual_objects).elements()),
+                    sorted((actual_objects - expected_objects).elements()))
+
+
+def synthetic_image(seed, width=400, height=300):
+    """A BGR section with noise, cells, saturated cells, touching clusters and cells right at the preset thresholds."""
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 120, size=(height, width, 3), dtype=np.uint8)
+
+    def red():
+        # Mostly bright cells, plus values on either side of each preset and saturated 255
+        choice = rng.integers(0, 4)
+        if choice == 0:
+            return int(rng.choice(PRESET_BRIGHTS)) + int(rng.integers(-1, 2))
+        if choice == 1:
+            return 255
+        return int(rng.integers(120, 256))
+
+    for _ in range(int(rng.integers(5, 60))):
+        centre = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        cv2.circle(image, centre, int(rng.integers(2, 18)), (0, 0, red()), -1)
+
+    for _ in range(int(rng.integers(0, 4))):
+        # Clusters: a few overlapping cells of the same brightness
+        x, y, value = int(rng.integers(0, width)), int(rng.integers(0, height)), red()
+        for _ in range(int(rng.integers(3, 8))):
+            centre = (x + int(rng.integers(-20, 21)), y + int(rng.integers(-20, 21)))
+            cv2.circle(image, centre, int(rng.integers(10, 20)), (0, 0, value), -1)
+
+    return image
+
+
+def check_synthetic(images=100, brights=PRESET_BRIGHTS, count=count_cells):
+    """Compare on images synthetic sections at every brightness; return the Mismatches."""
+    mismatches = []
+    for seed in range(images):
+        image = synthetic_image(seed)
+        for bright in brights:
+            mismatch = compare(image, bright, name="synthetic " + str(seed), count=count)
+            if mismatch is not None:
+                mismatches.append(mismatch)
+    return mismatches
+
+
+def _check_file(path, brights, min_area, cluster_max, crop):
+    # The original algorithm only ever saw cv2.imread's 8-bit BGR conversion
+    image = to_bgr8(load_image(path))
+    if crop:
+        # A centred crop keeps the pixel-loop reference affordable on big sections
+        height, width = image.shape[:2]
+        y, x = max((height - crop) // 2, 0), max((width - crop) // 2, 0)
+        image = image[y:y + crop, x:x + crop]
+    mismatches = []
+    for bright in brights:
+        mismatch = compare(image, bright, min_area, cluster_max, name=path)
+        if mismatch is not None:
+            mismatches.append(mismatch)
+    return mismatches
+
+
+def check_folder(folder, brights=PRESET_BRIGHTS, min_area=40, cluster_max=10000, crop=None, workers=None):
+    """Compare every image in folder (the whole image is the ROI); return the Mismatches."""
+    paths = [join(folder, f) for f in list_images(folder)]
+    n = len(paths)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(_check_file, paths, [brights] * n, [min_area] * n, [cluster_max] * n, [crop] * n)
+        return [mismatch for mismatches in results for mismatch in mismatches]
+
+
+def format_mismatch(mismatch):
+    lines = [str(mismatch.name) + " at brightness " + str(mismatch.bright) + ": expected left / right "
+             + str(mismatch.expected) + ", got " + str(mismatch.actual)]
+    for label, objects in (("only in reference", mismatch.missing), ("only in new", mismatch.extra)):
+        for x, y, area, cells, side in objects:
+            lines.append("    " + label + ": x=" + str(x) + " y=" + str(y) + " area=" + str(area)
+                         + " cells=" + str(cells) + " side=" + str(side))
+    return "\n".join(lines)
+
+
+def assert_same_counts(mismatches):
+    """Raise AssertionError listing every Mismatch (if there are any)."""
+    if mismatches:
+        raise AssertionError(str(len(mismatches)) + " count mismatch(es):\n"
+                             + "\n".join(format_mismatch(m) for m in mismatches))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check that the counting stage still matches the original algorithm.")
+    parser.add_argument("folders", nargs="*", help="folders of sample images (each whole image is counted)")
+    parser.add_argument("--synthetic", type=int, default=0, metavar="N", help="also check N synthetic sections")
+    parser.add_argument("--bright", type=int, nargs="+", default=list(PRESET_BRIGHTS), help="brightness values to check")
+    parser.add_argument("--min-area", type=int, default=40)
+    parser.add_argument("--cluster-max", type=int, default=10000)
+    parser.add_argument("--crop", type=int, default=None, metavar="PIXELS", help="only check a centred square of this size")
+    parser.add_argument("--workers", type=int, default=None)
+    args = parser.parse_args(argv)
+
+    mismatches = check_synthetic(args.synthetic, args.bright)
+    for folder in args.folders:
+        mismatches += check_folder(folder, args.bright, args.min_area, args.cluster_max, args.crop, args.workers)
+
+    for mismatch in mismatches:
+        print(format_mismatch(mismatch))
+    print(str(len(mismatches)) + " mismatch(es)")
+    return 1 if mismatches else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,156 @@
+# Memory-aware scheduling of the counting stage across worker processes.
+#
+# Sections range from small PNGs to multi-gigabyte TIFFs, so instead of a fixed
+# worker count every job gets a peak-memory estimate from its file header and
+# jobs are only started while the estimates of everything in flight fit in the
+# memory budget. Big images therefore run with few siblings and small ones with many.
+
+import os
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+from cellcount.counting import MAX_AREA, count_cells
+from cellcount.images import channel_names, decoded_bytes, load_rois, page_bytes, probe_image
+
+
+# One image to count: the path of the full-resolution file, its Annotation,
+# how the pages are projected if the file is a z-stack (see images.PROJECTIONS)
+# and the significant bits of its samples (None: read from the file header).
+CountJob = namedtuple("CountJob", ["path", "annotation", "projection", "bits"], defaults=["max", None])
+
+# Working bytes per ROI pixel while counting: the boolean temporaries of the
+# contrast filter, the uint8 mask, room for the contour / label data, the
+# background and corrected channel of the automatic threshold (up to 16-bit)
+# and the 8-bit BGR overlay.
+ROI_BYTES_PER_PIXEL = 3 + 1 + 4 + 4 + 3
+
+# Interpreter, numpy and OpenCV in every worker process.
+WORKER_OVERHEAD = 150 * 1024 ** 2
+
+# Used when the amount of physical memory cannot be read.
+FALLBACK_BUDGET = 2 * 1024 ** 3
+
+
+def default_memory_budget():
+    """Half of the machine's physical memory (or FALLBACK_BUDGET if unknown)."""
+    try:
+        total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return FALLBACK_BUDGET
+    return total // 2
+
+
+def estimate_job_memory(job, header=None):
+    """Estimate the peak memory of counting one job, in bytes."""
+    if header is None:
+        header = probe_image(job.path)
+    annotation = job.annotation
+
+    def pixels(x1, y1, x2, y2):
+        return max(min(x2, header.width) - max(x1, 0), 0) * max(min(y2, header.height) - max(y1, 0), 0)
+
+    boxes = list(annotation.rois.values())
+    roi_pixels = sum(pixels(*box) for box in boxes)
+    largest_roi = max(pixels(*box) for box in boxes)
+
+    full = decoded_bytes(header)
+    # Copies of all ROIs are held together
+    roi = roi_pixels * decoded_bytes(header) // max(header.width * header.height, 1)
+
+    # Decoding: every rotation allocates a second full image before the first is
+    # released, then the ROI is copied out.
+    decode_peak = full * (2 if annotation.rotations else 1) + roi
+    if header.pages > 1:
+        # Stacks hold one page (PIL's copy and the array) next to the running
+        # projection, which covers the whole page when it has to be rotated
+        # and otherwise the box around all ROIs.
+        if annotation.rotations:
+            projected = header.width * header.height
+        else:
+            projected = pixels(min(box[0] for box in boxes), min(box[1] for box in boxes),
+                               max(box[2] for box in boxes), max(box[3] for box in boxes))
+        sample_bytes = max(header.bits, 8) // 8 if job.projection == "max" else 8
+        decode_peak += 2 * page_bytes(header) + projected * header.channels * sample_bytes
+    # Counting: the full image is gone, only the ROI copies remain, next to the
+    # work arrays of the (ROI, channel) being counted.
+    count_peak = roi + largest_roi * ROI_BYTES_PER_PIXEL
+    return WORKER_OVERHEAD + max(decode_peak, count_peak)
+
+
+def count_job(job, keep_overlay=False, max_area=MAX_AREA):
+    """Decode one job once and count every channel in every ROI. Runs inside a worker process.
+
+    Returns {(ROI name, channel name): CountResult}, in annotation order.
+    Channels the image does not have are left out rather than failing the batch.
+    """
+    annotation = job.annotation
+    header = probe_image(job.path)
+    bits = job.bits if job.bits is not None else header.significant_bits
+    available = channel_names(header)
+    names = list(annotation.rois)
+    crops = load_rois(job.path, annotation.rotations, [annotation.rois[name] for name in names], job.projection)
+    results = {}
+    for name, cropped_image in zip(names, crops):
+        x1, y1, x2, y2 = annotation.rois[name]
+        for channel in annotation.channels:
+            if channel.name not in available:
+                continue
+            results[name, channel.name] = count_cells(cropped_image, channel.bright, channel.min_area,
+                                                      channel.cluster_max, max_area=max_area, middle=(x2 - x1) / 2,
+                                                      threshold=channel.threshold, overlay=keep_overlay,
+                                                      channel=channel.name, bits=bits)
+    return results
+
+
+def schedule(work, jobs, args=(), memory_budget=None, max_workers=None):
+    """Call work(job, *args) for every job in worker processes; return the results in job order.
+
+    At most max_workers jobs (default: one per CPU) run at once, and a job is
+    only started when its estimated peak memory fits in what is left of
+    memory_budget (default: default_memory_budget()). A job that does not fit
+    even on its own still runs, alone. work must be importable by the workers.
+    """
+    jobs = list(jobs)
+    if not jobs:
+        return []
+    if memory_budget is None:
+        memory_budget = default_memory_budget()
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, len(jobs))
+
+    if max_workers == 1:
+        return [work(job, *args) for job in jobs]
+
+    estimates = [estimate_job_memory(job) for job in jobs]
+
+    # Largest jobs go first so they are not left running alone at the end;
+    # smaller jobs fill whatever budget is left next to them.
+    pending = sorted(range(len(jobs)), key=lambda i: estimates[i], reverse=True)
+    results = [None] * len(jobs)
+    running = {}
+    in_use = 0
+
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        while pending or running:
+            for i in list(pending):
+                if len(running) >= max_workers:
+                    break
+                if running and in_use + estimates[i] > memory_budget:
+                    continue
+                pending.remove(i)
+                running[pool.submit(work, jobs[i], *args)] = i
+                in_use += estimates[i]
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = running.pop(future)
+                in_use -= estimates[i]
+                results[i] = future.result()
+
+    return results
+
+
+def run_jobs(jobs, memory_budget=None, max_workers=None, keep_overlays=False, max_area=MAX_AREA):
+    """Count every job and return the results of count_job in the same order as jobs (see schedule)."""
+    return schedule(count_job, jobs, (keep_overlays, max_area), memory_budget, max_workers)
@@ -0,0 +1,115 @@
+# Counts as a pandas table, keyed by animal, section and region, with grouped summaries.
+#
+# The animal, section and region of every file are parsed from its name, so the
+# table and everything computed from it (the Excel sheets, per-animal totals,
+# per-region means) do not depend on the order the files were counted in.
+# pandas is only imported when this module is.
+
+import numpy as np
+import pandas as pd
+
+from cellcount.excel import REGION_COLORS
+
+
+# Animal tag and section number in a file name, for example "3730.4" and 11 in
+# "Zymo6 3730.4 1-12_s11.tif" or "3556.1" and 1 in "3556.1 s_1.tif". Change it
+# (keeping the two named groups) for another naming scheme.
+NAME_PATTERN = r"(?P<animal>\d+\.\d+).*?[\s_-]s_?(?P<section>\d+)"
+
+# Files the pattern does not match take their animal tag from a fixed slice of the name:
+# The index values [6:13] represent the string "3730.4 " from the initial name "Zymo6 3730.4 1-12_s11.tif"
+# "3730.4 " represents the tag of the animal from which the section was collected. 
+# Hence, these index values will change according to the user's naming choice
+NAME_SLICE = slice(6, 13) #NAMING
+
+# Columns of results_frame, in order.
+COLUMNS = ["file", "animal", "section", "region", "roi", "channel", "left", "right", "total", "ratio"]
+
+
+def parse_names(files, pattern=NAME_PATTERN, name_slice=NAME_SLICE):
+    """Animal, section and region (A1 - C4 code, or NaN) of every file name, as a DataFrame.
+
+    Sections that cannot be parsed are numbered in file order within their
+    animal, after the highest section number parsed for it, so they never
+    take the number of a parsed section.
+    """
+    files = pd.Series(files, dtype=object)
+    parsed = files.str.extract(pattern)
+    animal = parsed["animal"].fillna(files.str[name_slice].str.strip())
+    section = pd.to_numeric(parsed["section"], errors="coerce")
+    unparsed = section.isna()
+    highest = section.groupby(animal).transform("max").fillna(0)
+    position = unparsed.groupby(animal).cumsum()
+    section = section.fillna(highest + position).astype(int)
+    # The first code of REGION_COLORS found in the name, like excel.region_color
+    region = pd.Series(np.nan, index=files.index, dtype=object)
+    for code in REGION_COLORS:
+        region = region.where(region.notna() | ~files.str.contains(code, regex=False), code)
+    return pd.DataFrame({"file": files, "animal": animal, "section": section, "region": region})
+
+
+def duplicate_names(files, pattern=NAME_PATTERN, name_slice=NAME_SLICE):
+    """Groups of files that parse to the same animal, section and region, which section_table cannot tell apart."""
+    names = parse_names(pd.unique(pd.Series(files, dtype=object)), pattern, name_slice)
+    names["region"] = names["region"].fillna("")
+    names = names[names.duplicated(["animal", "section", "region"], keep=False)]
+    return [list(group["file"]) for _, group in names.groupby(["animal", "section", "region"])]
+
+
+def results_frame(counts, pattern=NAME_PATTERN, name_slice=NAME_SLICE):
+    """One row per (file, ROI, channel) of count results, with the parsed animal / section / region.
+
+    counts maps (file, ROI name, channel name) to a CountResult or (left, right).
+    ratio is left / right (NaN where right is 0).
+    """
+    keys = list(counts)
+    frame = pd.DataFrame(keys, columns=["file", "roi", "channel"])
+    frame[["left", "right"]] = np.array([tuple(counts[key][:2]) for key in keys], dtype=np.int64).reshape(-1, 2)
+
+    # Every file name is parsed once, however many ROIs and channels it has
+    names = parse_names(frame["file"].unique(), pattern, name_slice)
+    frame = frame.merge(names, on="file", how="left")
+    frame["total"] = frame["left"] + frame["right"]
+    frame["ratio"] = frame["left"] / frame["right"].where(frame["right"] != 0)
+    return frame[COLUMNS]
+
+
+def animal_totals(frame):
+    """Left, right and total counts and the number of sections per animal (and ROI / channel)."""
+    totals = frame.groupby(["animal", "roi", "channel"]).agg(
+        sections=("section", "nunique"), left=("left", "sum"), right=("right", "sum"), total=("total", "sum"))
+    totals["ratio"] = totals["left"] / totals["right"].where(totals["right"] != 0)
+    return totals
+
+
+def region_means(frame):
+    """Mean left, right and total counts per section of every region (and ROI / channel)."""
+    # ratio is the mean of the per-section ratios, so big sections do not outweigh small ones
+    return frame.dropna(subset=["region"]).groupby(["region", "roi", "channel"]).agg(
+        sections=("file", "size"), left=("left", "mean"), right=("right", "mean"), total=("total", "mean"),
+        ratio=("ratio", "mean"))
+
+
+def section_table(frame, value, roi="roi", channel="red", aggfunc=None):
+    """value ("left", "right", ...) of one ROI / channel with a row per animal and a column per (section, region).
+
+    channel is a channel name, or a dict of the channel to take from each file
+    (e.g. its main channel: red, or c1 for hyperstacks); files missing from
+    the dict are left out. Animals and sections are sorted, whatever order the
+    files were counted in. Files of one section from different regions get a
+    column each (region is "" for names without a code). Several files with
+    the same animal, section and region raise ValueError unless aggfunc says
+    how to combine them.
+    """
+    if isinstance(channel, dict):
+        selected = frame["channel"] == frame["file"].map(channel)
+    else:
+        selected = frame["channel"] == channel
+    rows = frame[(frame["roi"] == roi) & selected]
+    rows = rows.assign(region=rows["region"].fillna(""))
+    if aggfunc is None:
+        duplicated = rows.duplicated(["animal", "section", "region"], keep=False)
+        if duplicated.any():
+            raise ValueError("Files with the same animal, section and region: " + ", ".join(rows.loc[duplicated, "file"]))
+        aggfunc = "first"
+    return rows.pivot_table(index="animal", columns=["section", "region"], values=value, aggfunc=aggfunc)
@@ -0,0 +1,425 @@
+# Pan / zoom viewer for placing ROIs on full-resolution section images.
+#
+# The image is shown as a pyramid of TILE_SIZE tiles: level 0 is full
+# resolution and every level above it halves the previous one. Only the tiles
+# in the window are rendered, each from the four tiles below it, and they are
+# kept in a small LRU cache, so the full-resolution image is never held as a
+# whole. Views zoomed out past the pyramid come from an overview, which is
+# taken from the reduced-resolution levels saved in the file (SubIFD / OME
+# pyramids) or else from the preview image. Only when neither exists is it
+# built by streaming every full-resolution pixel once, a band at a time,
+# with a warning.
+#
+# Full-resolution tiles of TIFF files are read from the strips / tiles of the
+# file they cover (tifffile is imported when a TIFF is opened; compressed files
+# other than deflate / packbits also need imagecodecs). Everything else, and
+# TIFFs tifffile cannot read, is decoded once in full, also with a warning.
+
+import math
+import warnings
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from cellcount.images import iter_pages, load_image, project_pages, stack_channels, to_bgr8
+
+
+# Side of a pyramid tile in pixels.
+TILE_SIZE = 512
+
+# Tiles kept in memory (8-bit BGR, so 256 tiles of 512 pixels are about 200 MB).
+CACHE_TILES = 256
+
+# Longest side of the overview, which serves every view zoomed out past it.
+OVERVIEW_SIZE = 4096
+
+# Size of the viewer window.
+VIEW_SIZE = (1200, 800)
+
+# Zoom step of one key press or mouse wheel click, and the closest zoom (screen
+# pixels per full-resolution pixel).
+ZOOM_STEP = 1.25
+MAX_ZOOM = 8
+
+_PAN_KEYS = {ord('j'): (-1, 0), ord('l'): (1, 0), ord('i'): (0, -1), ord('k'): (0, 1)}
+
+
+class _SegmentReader:
+    """Rectangles of a TIFF file (every page, projected), decoded from the strips / tiles they cover only."""
+
+    def __init__(self, path, projection="max"):
+        import tifffile
+
+        self._tiff = tifffile.TiffFile(path)
+        try:
+            if self._tiff.is_imagej and self._tiff.imagej_metadata.get("channels", 1) > 1:
+                raise ValueError("Hyperstack channels are not read by segment")
+            page = self._tiff.pages[0]
+            # Thumbnails and reduced-resolution copies are not z planes
+            self._pages = [p for p in self._tiff.pages
+                           if p.shape == page.shape and p.dtype == page.dtype and not p.subfiletype & 1]
+            self._projection = projection
+            if page.samplesperpixel > 1 and page.planarconfig != 1:
+                raise ValueError("Separate sample planes are not read by segment")
+            if page.photometric not in (1, 2) or len(page.shape) not in (2, 3):
+                raise ValueError("Only gray and RGB(A) images are read by segment")
+            self.height, self.width = page.imagelength, page.imagewidth
+            self.segment_rows, self._segment_columns = page.chunks[:2]
+            self._across = page.chunked[1]
+            # Fail here rather than in the viewer when a codec is missing
+            self.read(0, 0, 1, 1)
+        except Exception:
+            self._tiff.close()
+            raise
+
+    def read(self, x1, y1, x2, y2):
+        return project_pages((self._read_page(page, x1, y1, x2, y2) for page in self._pages), self._projection)
+
+    def overview(self, width, height):
+        """The smallest saved pyramid level of at least width x height pixels (projected), or None."""
+        levels = [level for level in self._tiff.series[0].levels[1:]
+                  if level.keyframe.imagewidth >= width and level.keyframe.imagelength >= height]
+        if not levels:
+            return None
+        level = min(levels, key=lambda level: level.keyframe.imagewidth)
+        pages = level.asarray().reshape((-1,) + level.keyframe.shape)
+        return project_pages((_to_bgr(page) for page in pages), self._projection)
+
+    def close(self):
+        self._tiff.close()
+
+    def _read_page(self, page, x1, y1, x2, y2):
+        out = np.zeros((y2 - y1, x2 - x1) + page.shape[2:], page.dtype)
+        raw = page.compression == 1 and page.fillorder == 1 and page.bitspersample == page.dtype.itemsize * 8
+        if raw and not page.is_tiled:
+            self._read_raw_rows(page, out, x1, y1, x2, y2)
+        else:
+            self._read_segments(page, out, x1, y1, x2, y2)
+        return _to_bgr(out)
+
+    def _read_raw_rows(self, page, out, x1, y1, x2, y2):
+        # Uncompressed strips: seek straight to the rows that are needed
+        fh = self._tiff.filehandle
+        dtype = page.dtype.newbyteorder(self._tiff.byteorder)
+        row_shape = page.shape[1:]
+        row_bytes = int(np.prod(row_shape)) * dtype.itemsize
+        for strip in range(y1 // self.segment_rows, (y2 - 1) // self.segment_rows + 1):
+            top = strip * self.segment_rows
+            first, last = max(y1, top), min(y2, top + self.segment_rows)
+            fh.seek(page.dataoffsets[strip] + (first - top) * row_bytes)
+            rows = np.frombuffer(fh.read((last - first) * row_bytes), dtype).reshape((last - first,) + row_shape)
+            out[first - y1:last - y1] = rows[:, x1:x2]
+
+    def _read_segments(self, page, out, x1, y1, x2, y2):
+        fh = self._tiff.filehandle
+        decode_args = {}
+        if page.compression in (6, 7, 34892, 33007):
+            # JPEG segments share their tables
+            decode_args = {"jpegtables": page.jpegtables, "jpegheader": page.jpegheader}
+        rows, columns = self.segment_rows, self._segment_columns
+        for row in range(y1 // rows, (y2 - 1) // rows + 1):
+            for column in range(x1 // columns, (x2 - 1) // columns + 1):
+                index = row * self._across + column
+                fh.seek(page.dataoffsets[index])
+                segment, (_, _, top, left, _), _ = page.decode(fh.read(page.databytecounts[index]), index,
+                                                               **decode_args)
+                if segment is None:
+                    continue
+                segment = segment[0] if out.ndim == 3 else segment[0, :, :, 0]
+                sy1, sy2 = max(y1, top), min(y2, top + segment.shape[0])
+                sx1, sx2 = max(x1, left), min(x2, left + segment.shape[1])
+                out[sy1 - y1:sy2 - y1, sx1 - x1:sx2 - x1] = segment[sy1 - top:sy2 - top, sx1 - left:sx2 - left]
+
+
+def _to_bgr(out):
+    # tifffile samples are RGB(A); the rest of the package uses BGR like OpenCV
+    if out.ndim == 3 and out.shape[2] == 3:
+        return cv2.cvtColor(out, cv2.COLOR_RGB2BGR)
+    if out.ndim == 3 and out.shape[2] == 4:
+        return cv2.cvtColor(out, cv2.COLOR_RGBA2BGR)
+    return out
+
+
+class _DecodedReader:
+    """Rectangles of an image that is decoded (and projected) once in full."""
+
+    segment_rows = 1024
+
+    def __init__(self, path, projection="max"):
+        warnings.warn(str(path) + " cannot be read by strips / tiles (no tifffile, a missing codec or an "
+                      "unsupported layout), so the viewer decodes and holds the whole image", stacklevel=4)
+        channels = stack_channels(path)
+        if channels is None:
+            self._image = load_image(path)
+        else:
+            self._image = project_pages(iter_pages(path), projection, channels=channels)
+        self.height, self.width = self._image.shape[:2]
+
+    def read(self, x1, y1, x2, y2):
+        return self._image[y1:y2, x1:x2]
+
+    def overview(self, width, height):
+        # The whole image is in memory already, so the overview is streamed from it
+        return None
+
+    def close(self):
+        self._image = None
+
+
+def _open_reader(path, projection):
+    if str(path).lower().endswith((".tif", ".tiff")):
+        try:
+            return _SegmentReader(path, projection)
+        except (ImportError, ValueError, KeyError):
+            # No tifffile, a missing codec or a layout that is not read by segment
+            pass
+    return _DecodedReader(path, projection)
+
+
+class TiledImage:
+    """A multi-resolution, tiled, 8-bit view of a full-resolution image.
+
+    Coordinates are full-resolution pixels of the image after rotations, the
+    same frame as Annotation ROIs. Tiles of level k cover TILE_SIZE * 2 ** k
+    full-resolution pixels and are rendered on first use. preview is a smaller
+    copy of the image (like the previews folder of EasyCellCounting.py) that
+    serves as the overview when the file has no pyramid levels of its own.
+    """
+
+    def __init__(self, path, rotations=(), projection="max", tile_size=TILE_SIZE, cache_tiles=CACHE_TILES,
+                 overview_size=OVERVIEW_SIZE, bits=None, preview=None):
+        # Significant bits of the samples, for the 8-bit conversion (see images.to_bgr8)
+        self.bits = bits
+        self.path = path
+        self._reader = _open_reader(path, projection)
+        self.width, self.height = self._reader.width, self._reader.height
+        self.tile_size = tile_size
+        self._cache = OrderedDict()
+        self._cache_tiles = cache_tiles
+
+        # The overview shrinks the image by a whole factor, so every band is
+        # averaged over the same pixel blocks
+        self.overview_factor = max(math.ceil(max(self.width, self.height) / overview_size), 1)
+        self._plain_overview = self._build_overview(preview)
+        # Zoom levels finer than the overview
+        self.levels = max(math.ceil(math.log2(self.overview_factor)), 1)
+
+        self.rotations = None
+        self.set_rotations(rotations)
+
+    def _build_overview(self, preview=None):
+        factor = self.overview_factor
+        width, height = self.width // factor * factor, self.height // factor * factor
+        size = (width // factor, height // factor)
+
+        # A saved pyramid level, then the preview: both cover the whole image,
+        # so only the part of it the overview covers is resized
+        level = self._reader.overview(*size)
+        if level is None and preview is not None and not isinstance(self._reader, _DecodedReader):
+            level = cv2.imread(str(preview))
+        if level is not None:
+            level = to_bgr8(level, self.bits)
+            crop = level[:round(level.shape[0] * height / self.height), :round(level.shape[1] * width / self.width)]
+            return cv2.resize(crop, size, interpolation=cv2.INTER_AREA)
+
+        if not isinstance(self._reader, _DecodedReader):
+            warnings.warn(str(self.path) + " has no pyramid levels or preview image, so its overview is built from "
+                          "every full-resolution pixel", stacklevel=3)
+        band = math.ceil(max(self._reader.segment_rows, self.tile_size) / factor) * factor
+        rows = []
+        for y in range(0, height, band):
+            pixels = to_bgr8(self._reader.read(0, y, width, min(y + band, height)), self.bits)
+            rows.append(cv2.resize(pixels, (width // factor, pixels.shape[0] // factor), interpolation=cv2.INTER_AREA))
+        return np.vstack(rows)
+
+    def set_rotations(self, rotations):
+        """Show the image rotated by the angles in rotations, applied in order (see images.rotate_image)."""
+        rotations = tuple(rotations)
+        if rotations == self.rotations:
+            return
+        self.rotations = rotations
+        self._cache.clear()
+
+        # The overview is rotated step by step like the previews; full-resolution
+        # tiles map straight back into the file with the combined rotation.
+        # (Corners that a step-by-step rotation would clip are shown.)
+        self.overview = self._plain_overview
+        matrix = np.eye(3)
+        centre = (self.width / 2, self.height / 2)
+        for angle in rotations:
+            overview_centre = tuple(np.array(self.overview.shape[1::-1]) / 2)
+            self.overview = cv2.warpAffine(self.overview, cv2.getRotationMatrix2D(overview_centre, angle, 1.0),
+                                           self.overview.shape[1::-1], flags=cv2.INTER_LINEAR)
+            matrix = np.vstack([cv2.getRotationMatrix2D(centre, angle, 1.0), [0, 0, 1]]) @ matrix
+        self._rotation = matrix if rotations else None
+
+    def close(self):
+        self._reader.close()
+        self._cache.clear()
+
+    def tile(self, level, tx, ty):
+        """The 8-bit BGR tile (tx, ty) of level (smaller than tile_size at the right and bottom edges)."""
+        key = (level, tx, ty)
+        tile = self._cache.get(key)
+        if tile is not None:
+            self._cache.move_to_end(key)
+            return tile
+
+        size = self.tile_size
+        if level == 0:
+            tile = self._read_tile(tx * size, ty * size, min((tx + 1) * size, self.width),
+                                   min((ty + 1) * size, self.height))
+        else:
+            # Halve the (up to) four tiles of the level below
+            columns, rows = self._tiles(level - 1)
+            children = [[self.tile(level - 1, x, y) for x in range(2 * tx, min(2 * tx + 2, columns))]
+                        for y in range(2 * ty, min(2 * ty + 2, rows))]
+            tile = np.vstack([np.hstack(row) for row in children])
+            tile = cv2.resize(tile, (max(tile.shape[1] // 2, 1), max(tile.shape[0] // 2, 1)),
+                              interpolation=cv2.INTER_AREA)
+
+        self._cache[key] = tile
+        if len(self._cache) > self._cache_tiles:
+            self._cache.popitem(last=False)
+        return tile
+
+    def _tiles(self, level):
+        # Number of tile columns and rows of a level
+        span = self.tile_size << level
+        return math.ceil(self.width / span), math.ceil(self.height / span)
+
+    def _read_tile(self, x1, y1, x2, y2):
+        if self._rotation is None:
+            return to_bgr8(self._reader.read(x1, y1, x2, y2), self.bits)
+
+        # Read the part of the file the rotated tile comes from and warp it into place
+        inverse = cv2.invertAffineTransform(self._rotation[:2])
+        corners = np.array([[x1, y1, 1], [x2, y1, 1], [x1, y2, 1], [x2, y2, 1]], dtype=np.float64) @ inverse.T
+        sx1, sy1 = np.floor(corners.min(axis=0)).astype(int) - 2
+        sx2, sy2 = np.ceil(corners.max(axis=0)).astype(int) + 2
+        sx1, sy1, sx2, sy2 = max(sx1, 0), max(sy1, 0), min(sx2, self.width), min(sy2, self.height)
+        if sx2 <= sx1 or sy2 <= sy1:
+            return np.zeros((y2 - y1, x2 - x1, 3), np.uint8)
+        source = self._reader.read(sx1, sy1, sx2, sy2)
+        shift = np.array([[1, 0, -x1], [0, 1, -y1], [0, 0, 1]]) @ self._rotation @ \
+            np.array([[1, 0, sx1], [0, 1, sy1], [0, 0, 1]])
+        return to_bgr8(cv2.warpAffine(source, shift[:2], (x2 - x1, y2 - y1), flags=cv2.INTER_LINEAR), self.bits)
+
+    def render(self, x, y, scale, width, height):
+        """An 8-bit BGR view of width x height screen pixels.
+
+        Screen pixel (u, v) shows full-resolution pixel (x + u / scale, y + v / scale);
+        whatever lies outside the image is black.
+        """
+        if 1 / scale >= self.overview_factor:
+            source, factor, left, top = self.overview, self.overview_factor, 0, 0
+        else:
+            level = min(max(int(math.floor(math.log2(1 / scale))), 0), self.levels - 1)
+            factor = 1 << level
+            source, left, top = self._mosaic(level, x / factor, y / factor,
+                                             (x + width / scale) / factor, (y + height / scale) / factor)
+
+        # source pixel (i, j) of the level is full-resolution pixel ((left + i) * factor, (top + j) * factor)
+        zoom = scale * factor
+        matrix = np.array([[zoom, 0, (left * factor - x) * scale], [0, zoom, (top * factor - y) * scale]],
+                          dtype=np.float64)
+        # Nearest neighbour once single pixels are visible, so ROI edges can be placed on them
+        flags = cv2.INTER_NEAREST if zoom > 1 else cv2.INTER_LINEAR
+        return cv2.warpAffine(source, matrix, (int(width), int(height)), flags=flags)
+
+    def _mosaic(self, level, x1, y1, x2, y2):
+        # The tiles of level covering the level-pixel rectangle, stitched; returns it and its top left corner
+        size = self.tile_size
+        columns, rows = self._tiles(level)
+        tx1, ty1 = min(max(int(x1) // size, 0), columns - 1), min(max(int(y1) // size, 0), rows - 1)
+        tx2, ty2 = min(max(int(math.ceil(x2)) // size, 0), columns - 1), min(max(int(math.ceil(y2)) // size, 0), rows - 1)
+        mosaic = np.vstack([np.hstack([self.tile(level, tx, ty) for tx in range(tx1, tx2 + 1)])
+                            for ty in range(ty1, ty2 + 1)])
+        return mosaic, tx1 * size, ty1 * size
+
+    def fit(self, width, height):
+        """The whole image scaled to fit in width x height."""
+        scale = min(width / self.width, height / self.height)
+        return self.render(0, 0, scale, max(int(self.width * scale), 1), max(int(self.height * scale), 1))
+
+
+def pan_zoom_roi(tiled, window="select the area", size=VIEW_SIZE):
+    """Let the user draw a box on a TiledImage; return it as (x1, y1, x2, y2) in full-resolution pixels.
+
+    Drag with the left mouse button to draw the box (again to redraw it), zoom
+    with the mouse wheel or "+" / "-" and pan with the right mouse button or
+    "i", "j", "k", "l". Space or enter confirms, "c" or escape cancels and
+    gives (0, 0, 0, 0), like cv2.selectROI.
+    """
+    width, height = size
+    fit = min(width / tiled.width, height / tiled.height)
+    # Full-resolution pixel at the top left of the window, and screen pixels per full-resolution pixel
+    view = {"x": 0.0, "y": 0.0, "scale": fit}
+    box = {"start": None, "end": None}
+    drag = {}
+
+    def to_image(u, v):
+        return view["x"] + u / view["scale"], view["y"] + v / view["scale"]
+
+    def zoom(factor, u, v):
+        # Zoom around screen pixel (u, v)
+        x, y = to_image(u, v)
+        view["scale"] = min(max(view["scale"] * factor, fit), MAX_ZOOM)
+        view["x"], view["y"] = x - u / view["scale"], y - v / view["scale"]
+
+    def clamp(value, high):
+        return min(max(int(round(value)), 0), high)
+
+    def on_mouse(event, u, v, flags, param):
+        if event == cv2.EVENT_LBUTTONDOWN:
+            box["start"] = box["end"] = to_image(u, v)
+            drag["box"] = True
+        elif event == cv2.EVENT_RBUTTONDOWN:
+            drag["pan"] = (u, v, view["x"], view["y"])
+        elif event == cv2.EVENT_MOUSEMOVE:
+            if drag.get("box"):
+                box["end"] = to_image(u, v)
+            elif drag.get("pan"):
+                u0, v0, x0, y0 = drag["pan"]
+                view["x"], view["y"] = x0 - (u - u0) / view["scale"], y0 - (v - v0) / view["scale"]
+        elif event == cv2.EVENT_LBUTTONUP:
+            box["end"] = to_image(u, v)
+            drag.pop("box", None)
+        elif event == cv2.EVENT_RBUTTONUP:
+            drag.pop("pan", None)
+        elif event == cv2.EVENT_MOUSEWHEEL:
+            zoom(ZOOM_STEP if flags > 0 else 1 / ZOOM_STEP, u, v)
+
+    cv2.namedWindow(window)
+    cv2.setMouseCallback(window, on_mouse)
+    try:
+        while True:
+            frame = tiled.render(view["x"], view["y"], view["scale"], width, height)
+            if box["start"] is not None:
+                (x1, y1), (x2, y2) = box["start"], box["end"]
+                corners = [(int(round((x - view["x"]) * view["scale"])), int(round((y - view["y"]) * view["scale"])))
+                           for x, y in ((x1, y1), (x2, y2))]
+                cv2.rectangle(frame, corners[0], corners[1], (255, 0, 0), 2)
+            cv2.imshow(window, frame)
+
+            key = cv2.waitKey(20) & 0xFF
+            if key in (ord(' '), 13):
+                if box["start"] is None:
+                    continue
+                (x1, y1), (x2, y2) = box["start"], box["end"]
+                return (clamp(min(x1, x2), tiled.width), clamp(min(y1, y2), tiled.height),
+                        clamp(max(x1, x2), tiled.width), clamp(max(y1, y2), tiled.height))
+            if key in (ord('c'), 27):
+                return 0, 0, 0, 0
+            if key in (ord('+'), ord('=')):
+                zoom(ZOOM_STEP, width / 2, height / 2)
+            elif key == ord('-'):
+                zoom(1 / ZOOM_STEP, width / 2, height / 2)
+            elif key in _PAN_KEYS:
+                dx, dy = _PAN_KEYS[key]
+                # A quarter of the window per key press
+                view["x"] += dx * width / 4 / view["scale"]
+                view["y"] += dy * height / 4 / view["scale"]
+    finally:
+        cv2.destroyWindow(window)
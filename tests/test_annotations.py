@@ -0,0 +1,62 @@
+# Checks of the per-image annotation records and their undo / redo history.
+
+from cellcount.annotations import Annotation, AnnotationStore, Channel
+
+
+FILES = ("a", "b")
+
+
+def _state(store):
+    return {file: store.get(file) for file in FILES}
+
+
+def test_undo_and_redo_replay_every_state():
+    store = AnnotationStore()
+    assert store.undo() is None and store.redo() is None
+
+    store.set(Annotation("a", {"roi": (0, 0, 10, 10)}))
+    store.set(Annotation("b", {"roi": (0, 0, 10, 10)}))
+    store.set(Annotation("a", {"roi": (0, 0, 20, 10)}, [7]))
+
+    states = [_state(store)]
+    while store.undo() is not None:
+        states.append(_state(store))
+    assert len(store) == 0 and len(states) == 4
+
+    for state in reversed(states[:-1]):
+        assert store.redo() is not None
+        assert _state(store) == state
+    assert store.redo() is None
+
+
+def test_a_new_change_drops_the_redo_history():
+    store = AnnotationStore()
+    store.set(Annotation("a", {"roi": (0, 0, 10, 10)}))
+    store.set(Annotation("b", {"roi": (0, 0, 10, 10)}))
+    store.set(Annotation("a", {"roi": (0, 0, 20, 10)}))
+
+    assert store.undo() == "a"
+    assert store["a"] == Annotation("a", {"roi": (0, 0, 10, 10)})
+    store.remove("b")
+    assert store.redo() is None
+    assert "b" not in store
+    assert store.undo() == "b"
+    assert store["b"] == Annotation("b", {"roi": (0, 0, 10, 10)})
+
+
+def test_save_and_load(tmp_path):
+    store = AnnotationStore()
+    store.set(Annotation("a", {"roi": (1, 2, 30, 40), "dorsal": (5, 5, 9, 9)}, [7, -7], [Channel(bright=200)]))
+    store.set(Annotation("b", {"roi": (0, 0, 10, 10)}, [],
+                         [Channel(min_area=20, cluster_max=1000000), Channel("green", threshold="auto")]))
+    store.save(str(tmp_path / "annotations.json"))
+
+    loaded = AnnotationStore.load(str(tmp_path / "annotations.json"))
+    assert [loaded.get(file) for file in FILES] == [store.get(file) for file in FILES]
+
+
+def test_single_roi_annotations_still_load():
+    data = {"file": "a", "roi": [1, 2, 30, 40], "rotations": [7], "bright": 200, "min_area": 20,
+            "cluster_max": 10000, "threshold": "auto"}
+    assert Annotation.from_dict(data) == Annotation("a", {"roi": (1, 2, 30, 40)}, [7],
+                                                    [Channel("red", 200, 20, 10000, "auto")])
@@ -0,0 +1,47 @@
+# Checks of the parameter sweep: the contour table must count like count_contours.
+
+import cv2
+import pytest
+
+from cellcount.annotations import Annotation
+from cellcount.calibration import calibrate, parameter_grid
+from cellcount.counting import contour_table, contrast_filter, count_cells, count_contours, count_table
+from cellcount.images import load_roi
+from cellcount.regression import PRESET_BRIGHTS, synthetic_image
+
+
+SETTINGS = ((40, 900, 10000), (10, 300, 2000), (80, 1500, 1000000))
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_count_table_matches_count_contours(seed):
+    image = synthetic_image(seed)
+    for bright in PRESET_BRIGHTS:
+        mask = contrast_filter(image, bright)
+        areas, xs = contour_table(mask)
+        middle = mask.shape[1] / 2
+        for min_area, max_area, cluster_max in SETTINGS:
+            expected = count_contours(mask, min_area, cluster_max, max_area, middle)
+            assert count_table(areas, xs, middle, min_area, cluster_max, max_area) == (expected.left, expected.right)
+
+
+def test_calibrate_counts_every_parameter_set(tmp_path):
+    annotations = []
+    for seed in range(3):
+        name = "s" + str(seed) + ".png"
+        cv2.imwrite(str(tmp_path / name), synthetic_image(seed))
+        annotations.append(Annotation(name, {"roi": (20, 10, 380, 290)}, [7] if seed == 1 else []))
+    grid = parameter_grid([160, 200], [20, 40], [900], [10000])
+    truth = {"s0.png": (3, 4)}
+
+    calibrations = calibrate(str(tmp_path), annotations, grid, truth, max_workers=2)
+    assert sorted(calibration.parameters for calibration in calibrations) == sorted(grid)
+    for calibration in calibrations:
+        bright, min_area, max_area, cluster_max = calibration.parameters
+        for annotation in annotations:
+            cropped_image = load_roi(str(tmp_path / annotation.file), annotation.rotations, annotation.rois["roi"])
+            result = count_cells(cropped_image, bright, min_area, cluster_max, max_area, middle=360 / 2)
+            assert calibration.counts[annotation.file] == (result.left, result.right)
+        left, right = calibration.counts["s0.png"]
+        assert calibration.error == (abs(left - 3) + abs(right - 4)) / 2
+    assert [c.error for c in calibrations] == sorted(c.error for c in calibrations)
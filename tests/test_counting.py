@@ -0,0 +1,118 @@
+# Checks of the counting filters: the automatic threshold and native bit depths.
+
+import cv2
+import numpy as np
+import pytest
+
+from cellcount.counting import auto_threshold_filter, count_cells, estimate_background, otsu_level
+from cellcount.images import native_brightness
+from cellcount.regression import PRESET_BRIGHTS, synthetic_image
+
+
+def _uneven_section(seed=0, width=400, height=300):
+    # Background lit from dark (20) on the left to bright (180) on the right, with
+    # 12 cells 60 above their local background: no single brightness separates them
+    rng = np.random.default_rng(seed)
+    background = np.tile(np.linspace(20, 180, width), (height, 1))
+    red = background + rng.normal(0, 3, size=(height, width))
+    cells = [(40 + 64 * (i % 6), 60 + 180 * (i // 6)) for i in range(12)]
+    for x, y in cells:
+        disc = np.zeros((height, width), np.uint8)
+        cv2.circle(disc, (x, y), 7, 1, -1)
+        red[disc == 1] = background[disc == 1] + 60
+    image = np.zeros((height, width, 3), np.uint8)
+    image[:, :, 2] = np.clip(np.rint(red), 0, 255)
+    return image, background, cells
+
+
+def _between_class_variance(values, level):
+    below, above = values[values <= level], values[values > level]
+    if not len(below) or not len(above):
+        return 0.0
+    return len(below) * len(above) * (below.mean() - above.mean()) ** 2
+
+
+def test_otsu_level():
+    values = np.array([10] * 100 + [200] * 50, dtype=np.uint8)
+    assert 10 <= otsu_level(values) < 200
+
+    rng = np.random.default_rng(0)
+    for _ in range(5):
+        values = np.concatenate([rng.normal(40, 10, 500), rng.normal(150, 20, 200)]).clip(0, 255).astype(np.uint8)
+        best = max(_between_class_variance(values, level) for level in range(256))
+        assert _between_class_variance(values, otsu_level(values)) == pytest.approx(best)
+
+
+def test_background_leaves_out_cells():
+    image, background, cells = _uneven_section()
+    estimate = estimate_background(image[:, :, 2]).astype(np.float64)
+    # Away from the left and right edges the estimate follows the lighting, also
+    # under the cells, well within the cell contrast of 60
+    assert np.abs(estimate - background)[:, 30:-30].max() < 15
+    assert all(abs(estimate[y, x] - background[y, x]) < 15 for x, y in cells)
+
+
+def test_auto_threshold_on_uneven_lighting():
+    image, background, cells = _uneven_section()
+    mask = auto_threshold_filter(image)
+    assert all(mask[y, x] == 255 for x, y in cells)
+    # Only the cells are left, even where the background is brighter than the dimmest cell
+    assert np.count_nonzero(mask) < 12 * np.pi * 8 ** 2
+
+    result = count_cells(image.copy(), 0, 40, 10000, threshold="auto")
+    assert (result.left, result.right) == (6, 6)
+    # No fixed brightness finds the dim cells without taking in the bright background
+    assert count_cells(image.copy(), 100, 40, 10000)[:2] != (6, 6)
+
+
+def test_auto_threshold_ignores_noise():
+    rng = np.random.default_rng(1)
+    image = np.zeros((200, 200, 3), np.uint8)
+    image[:, :, 2] = rng.integers(50, 58, size=(200, 200))
+    assert np.count_nonzero(auto_threshold_filter(image)) == 0
+
+
+def test_unknown_threshold_mode():
+    with pytest.raises(ValueError):
+        count_cells(np.zeros((10, 10, 3), np.uint8), 160, 40, 10000, threshold="otsu")
+
+
+def _to_16_bit(image):
+    # 8-bit value v becomes v * 256 + 255, so v >= bright exactly when it is >= native_brightness(bright, 16)
+    return (image.astype(np.uint16) << 8) | np.uint16(255)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_16_bit_counts_like_8_bit(seed):
+    image = synthetic_image(seed)
+    for bright in PRESET_BRIGHTS:
+        expected = count_cells(image, bright, 40, 10000)
+        assert count_cells(_to_16_bit(image), native_brightness(bright, 16), 40, 10000)[:2] == expected[:2]
+        # A single-channel image is its own red channel
+        gray = _to_16_bit(image[:, :, 2])
+        assert count_cells(gray, native_brightness(bright, 16), 40, 10000, overlay=False)[:2] == expected[:2]
+
+
+def test_16_bit_auto_threshold():
+    image, background, cells = _uneven_section()
+    assert count_cells(_to_16_bit(image), 0, 40, 10000, threshold="auto")[:2] == (6, 6)
+
+
+def _to_12_bit(image):
+    # 12-bit data in 16-bit samples: 8-bit value v becomes v * 16 + 15
+    return (image.astype(np.uint16) << 4) | np.uint16(15)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_12_bit_counts_like_8_bit(seed):
+    image = synthetic_image(seed)
+    for bright in PRESET_BRIGHTS:
+        expected = count_cells(image, bright, 40, 10000)
+        result = count_cells(_to_12_bit(image), native_brightness(bright, 12), 40, 10000, bits=12)
+        assert result[:2] == expected[:2]
+        assert (result.overlay == expected.overlay).all()
+
+
+def test_12_bit_auto_threshold():
+    image, background, cells = _uneven_section()
+    assert count_cells(_to_12_bit(image), 0, 40, 10000, threshold="auto", bits=12)[:2] == (6, 6)
@@ -0,0 +1,102 @@
+# Checks of image loading: z-stack projection, cropping and rotations.
+
+import cv2
+import numpy as np
+import pytest
+from PIL import Image
+
+from cellcount.images import (channel_plane, iter_pages, load_roi, load_rois, probe_image, project_pages, rotate_image,
+                              stack_channels)
+
+
+def _write_stack(path, pages):
+    images = [Image.fromarray(page) for page in pages]
+    images[0].save(str(path), save_all=True, append_images=images[1:])
+    return str(path)
+
+
+@pytest.fixture
+def planes():
+    return np.random.default_rng(0).integers(0, 65536, size=(4, 60, 80), dtype=np.uint16)
+
+
+def test_stack_header_and_pages(tmp_path, planes):
+    path = _write_stack(tmp_path / "stack.tif", planes)
+    header = probe_image(path)
+    assert (header.width, header.height, header.pages, header.bits) == (80, 60, 4, 16)
+    assert stack_channels(path) == 1
+    assert all((page == plane).all() for page, plane in zip(iter_pages(path), planes))
+
+
+def test_projections(planes):
+    assert (project_pages(iter(planes), "max") == planes.max(axis=0)).all()
+    expected = np.clip(planes.astype(np.float64).sum(axis=0), 0, 65535).astype(np.uint16)
+    assert (project_pages(iter(planes), "sum") == expected).all()
+    assert (project_pages(iter(planes), "mean") == np.rint(planes.mean(axis=0)).astype(np.uint16)).all()
+    assert (project_pages(iter(planes), box=(10, 5, 30, 25)) == planes.max(axis=0)[5:25, 10:30]).all()
+    with pytest.raises(ValueError):
+        project_pages(iter(planes), "median")
+
+
+def test_stack_roi_is_cropped_from_the_projection(tmp_path, planes):
+    path = _write_stack(tmp_path / "stack.tif", planes)
+    projected = planes.max(axis=0)
+    assert (load_roi(path, [], (10, 5, 30, 25)) == projected[5:25, 10:30]).all()
+    # With rotations the whole projection is rotated first, like the preview
+    assert (load_roi(path, [7, 180], (10, 5, 30, 25)) == rotate_image(rotate_image(projected, 7), 180)[5:25, 10:30]).all()
+
+
+def test_16_bit_images_keep_their_depth(tmp_path):
+    gray = np.random.default_rng(1).integers(0, 65536, size=(60, 80), dtype=np.uint16)
+    cv2.imwrite(str(tmp_path / "gray.png"), gray)
+    header = probe_image(str(tmp_path / "gray.png"))
+    assert (header.channels, header.bits) == (1, 16)
+    assert (load_roi(str(tmp_path / "gray.png"), [], (10, 5, 30, 25)) == gray[5:25, 10:30]).all()
+
+
+def test_several_rois_from_one_decode(tmp_path, planes):
+    path = _write_stack(tmp_path / "stack.tif", planes)
+    rois = [(10, 5, 30, 25), (0, 0, 80, 60), (40, 30, 45, 50)]
+    for rotations in ([], [7]):
+        assert all((crop == load_roi(path, rotations, roi)).all()
+                   for crop, roi in zip(load_rois(path, rotations, rois), rois))
+
+
+def test_channel_planes():
+    image = np.arange(24, dtype=np.uint8).reshape(2, 4, 3)
+    assert (channel_plane(image, "green") == image[:, :, 1]).all()
+    assert (channel_plane(image[:, :, 0]) == image[:, :, 0]).all()
+    with pytest.raises(ValueError):
+        channel_plane(image[:, :, 0], "green")
+    with pytest.raises(ValueError):
+        channel_plane(image, "violet")
+
+
+def test_thumbnails_are_not_z_planes(tmp_path, planes):
+    tifffile = pytest.importorskip("tifffile")
+    path = str(tmp_path / "stack.tif")
+    with tifffile.TiffWriter(path) as tif:
+        for plane in planes:
+            tif.write(plane)
+        tif.write(planes[0][::2, ::2].copy(), subfiletype=1)
+    assert len(list(iter_pages(path))) == 4
+    assert (load_roi(path, [], (0, 0, 80, 60)) == planes.max(axis=0)).all()
+
+
+def test_hyperstack_channels_are_projected_separately(tmp_path):
+    tifffile = pytest.importorskip("tifffile")
+    stack = np.random.default_rng(2).integers(0, 65536, size=(3, 2, 60, 80), dtype=np.uint16)
+    path = str(tmp_path / "hyperstack.tif")
+    tifffile.imwrite(path, stack, imagej=True, metadata={"axes": "ZCYX"})
+
+    assert stack_channels(path) == 2
+    header = probe_image(path)
+    assert (header.channels, header.pages, header.hyperstack) == (2, 6, True)
+    image = load_roi(path, [], (0, 0, 80, 60))
+    assert image.shape == (60, 80, 2)
+    assert (channel_plane(image, "c1") == stack[:, 0].max(axis=0)).all()
+    assert (channel_plane(image, "c2") == stack[:, 1].max(axis=0)).all()
+    with pytest.raises(ValueError):
+        channel_plane(image, "red")
+    with pytest.raises(ValueError):
+        channel_plane(image, "c3")
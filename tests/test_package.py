@@ -0,0 +1,40 @@
+# Checks of the command line script: quick imports without side effects, the file list and the options.
+
+import subprocess
+import sys
+from pathlib import Path
+
+import pytest
+
+from cellcount.files import list_images
+
+
+ROOT = Path(__file__).parent.parent
+
+
+def test_import_loads_no_optional_packages():
+    # Worker processes import these modules; PIL, openpyxl and pandas are only loaded when they are used
+    code = ("import sys, EasyCellCounting, cellcount.scheduler, cellcount.excel, cellcount.files; "
+            "print(sorted(name for name in ('PIL', 'openpyxl', 'pandas') if name in sys.modules))")
+    output = subprocess.run([sys.executable, "-c", code], cwd=ROOT, capture_output=True, text=True, check=True)
+    assert output.stdout.strip() == "[]"
+
+
+def test_list_images_sorts_by_name(tmp_path):
+    names = ["Zymo6 3730.4 1-12_s2.tif", "Zymo6 3730.4 1-12_s1.tif", "Zymo6 3556.1 s_1.tif"]
+    for name in names:
+        (tmp_path / name).touch()
+    (tmp_path / "folder").mkdir()
+    assert list_images(str(tmp_path)) == sorted(names)
+
+
+def test_channel_option():
+    import argparse
+
+    from EasyCellCounting import channel_option
+
+    assert channel_option("green=200") == ("green", 200)
+    assert channel_option("c2=auto") == ("c2", None)
+    for text in ("red=200", "c0=200", "violet=200", "green", "green=bright"):
+        with pytest.raises(argparse.ArgumentTypeError):
+            channel_option(text)
@@ -0,0 +1,26 @@
+# The counting stage against the frozen copy of the original algorithm.
+
+import cv2
+import pytest
+
+from cellcount.counting import count_cells
+from cellcount.regression import assert_same_counts, check_folder, check_synthetic, synthetic_image
+
+
+def test_synthetic_sections_match_reference():
+    assert_same_counts(check_synthetic(20))
+
+
+def test_sample_folder_matches_reference(tmp_path):
+    for seed in range(3):
+        cv2.imwrite(str(tmp_path / ("s" + str(seed) + ".png")), synthetic_image(seed + 100))
+    assert_same_counts(check_folder(str(tmp_path), workers=2))
+
+
+def test_a_changed_count_is_reported():
+    def off_by_one(*args, **kwargs):
+        result = count_cells(*args, **kwargs)
+        return result._replace(left=result.left + 1)
+
+    with pytest.raises(AssertionError, match="mismatch"):
+        assert_same_counts(check_synthetic(1, count=off_by_one))
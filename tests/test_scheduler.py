@@ -0,0 +1,112 @@
+# Checks of the memory-aware scheduling of the counting stage.
+
+import runpy
+from pathlib import Path
+
+import cv2
+import numpy as np
+import pytest
+
+from cellcount.annotations import Annotation, Channel
+from cellcount.counting import count_cells
+from cellcount.images import channel_names, load_roi, native_brightness, probe_image
+from cellcount.scheduler import CountJob, count_job, estimate_job_memory, run_jobs
+
+
+def _write_section(path, seed, width=300, height=200):
+    rng = np.random.default_rng(seed)
+    image = rng.integers(0, 120, size=(height, width, 3), dtype=np.uint8)
+    for _ in range(20):
+        centre = (int(rng.integers(0, width)), int(rng.integers(0, height)))
+        cv2.circle(image, centre, int(rng.integers(4, 12)), (0, 0, int(rng.integers(170, 250))), -1)
+    cv2.imwrite(str(path), image)
+    return str(path)
+
+
+def _job(path, rotations=(), roi=(0, 0, 300, 200)):
+    return CountJob(path, Annotation(Path(path).name, {"roi": roi}, rotations))
+
+
+def test_estimate_grows_with_image_and_rotations(tmp_path):
+    small = _write_section(tmp_path / "small.png", 0)
+    big = _write_section(tmp_path / "big.png", 0, 1200, 800)
+    assert estimate_job_memory(_job(big)) > estimate_job_memory(_job(small))
+    assert estimate_job_memory(_job(big, [7])) > estimate_job_memory(_job(big))
+
+
+def test_run_jobs_keeps_job_order(tmp_path):
+    jobs = [_job(_write_section(tmp_path / (str(seed) + ".png"), seed)) for seed in range(4)]
+    expected = [count_job(job)["roi", "red"][:2] for job in jobs]
+    # A budget of one byte runs the jobs one at a time, in whatever order they finish
+    assert [result["roi", "red"][:2] for result in run_jobs(jobs, memory_budget=1, max_workers=2)] == expected
+    assert [result["roi", "red"][:2] for result in run_jobs(jobs, max_workers=2)] == expected
+
+
+def test_script_does_nothing_when_imported_by_a_worker():
+    # Spawned workers import the main script as __mp_main__; it must not start the interactive session
+    names = runpy.run_path(str(Path(__file__).parent.parent / "EasyCellCounting.py"), run_name="__mp_main__")
+    assert "rotate_image" in names
+
+
+def test_every_channel_is_counted_in_every_roi(tmp_path):
+    path = _write_section(tmp_path / "section.png", 3)
+    rois = {"roi": (0, 0, 300, 200), "dorsal": (50, 20, 250, 120)}
+    channels = [Channel("red", 160), Channel("green", min_area=10, threshold="auto")]
+    job = CountJob(path, Annotation("section.png", rois, [7], channels))
+
+    results = count_job(job)
+    assert list(results) == [(name, channel.name) for name in rois for channel in channels]
+    for (name, channel_name), result in results.items():
+        channel = channels[[c.name for c in channels].index(channel_name)]
+        x1, y1, x2, y2 = rois[name]
+        expected = count_cells(load_roi(path, [7], rois[name]), channel.bright, channel.min_area, channel.cluster_max,
+                               middle=(x2 - x1) / 2, threshold=channel.threshold, channel=channel_name)
+        assert result[:2] == expected[:2]
+    # A second ROI adds its pixels to the estimate
+    assert estimate_job_memory(job) >= estimate_job_memory(_job(path, [7]))
+
+
+def test_significant_bits_come_from_the_file(tmp_path):
+    tifffile = pytest.importorskip("tifffile")
+    image = cv2.imread(_write_section(tmp_path / "section.png", 5))
+    red = (image[:, :, 2].astype(np.uint16) << 4) | np.uint16(15)
+    tifffile.imwrite(str(tmp_path / "tagged.tif"), red, extratags=[(341, "H", 1, 4095, False)])
+    tifffile.imwrite(str(tmp_path / "untagged.tif"), red)
+    assert probe_image(str(tmp_path / "tagged.tif")).significant_bits == 12
+    assert probe_image(str(tmp_path / "untagged.tif")).significant_bits == 16
+
+    expected = count_cells(image, 160, 40, 10000)[:2]
+    annotation = Annotation("section", {"roi": (0, 0, 300, 200)}, [], [Channel("red", native_brightness(160, 12))])
+    assert count_job(CountJob(str(tmp_path / "tagged.tif"), annotation))["roi", "red"][:2] == expected
+    # --bits overrides the header
+    assert count_job(CountJob(str(tmp_path / "untagged.tif"), annotation, bits=12))["roi", "red"][:2] == expected
+
+
+def test_channels_an_image_lacks_are_skipped(tmp_path):
+    image = cv2.imread(_write_section(tmp_path / "section.png", 6))
+    cv2.imwrite(str(tmp_path / "gray.png"), image[:, :, 2])
+    assert channel_names(probe_image(str(tmp_path / "gray.png"))) == ("red", "gray")
+    assert "green" in channel_names(probe_image(str(tmp_path / "section.png")))
+
+    annotation = Annotation("gray.png", {"roi": (0, 0, 300, 200)}, [], [Channel("red"), Channel("green")])
+    results = count_job(CountJob(str(tmp_path / "gray.png"), annotation))
+    assert list(results) == [("roi", "red")]
+    assert results["roi", "red"][:2] == count_cells(image, 160, 40, 10000)[:2]
+
+
+def test_16_bit_colour_files_are_counted_at_their_depth(tmp_path):
+    tifffile = pytest.importorskip("tifffile")
+    image = np.full((200, 300, 3), 1000, dtype=np.uint16)
+    cv2.circle(image, (60, 100), 10, (0, 0, 50000), -1)
+    cv2.imwrite(str(tmp_path / "section.png"), image)
+    # A stack of three planes, in tifffile's RGB order
+    tifffile.imwrite(str(tmp_path / "stack.tif"), np.stack([image[:, :, ::-1]] * 3), photometric="rgb")
+
+    for name in ("section.png", "stack.tif"):
+        path = str(tmp_path / name)
+        header = probe_image(path)
+        assert header.bits == header.significant_bits == 16
+        # The preset is scaled to the file's depth, as the interactive session does
+        channel = Channel("red", native_brightness(160, header.significant_bits))
+        result = count_job(CountJob(path, Annotation(name, {"roi": (0, 0, 300, 200)}, [], [channel])))
+        assert result["roi", "red"][:2] == (1, 0)
@@ -0,0 +1,103 @@
+# Checks of the results table and the Excel export built from it.
+
+import math
+
+import pytest
+
+from cellcount.summary import animal_totals, duplicate_names, parse_names, region_means, results_frame, section_table
+
+openpyxl = pytest.importorskip("openpyxl")
+
+
+COUNTS = {
+    ("Zymo6 3730.4 1-12_s2 A1.tif", "roi", "red"): (4, 2),
+    ("Zymo6 3730.4 1-12_s1 A1.tif", "roi", "red"): (3, 0),
+    ("Zymo6 3730.4 1-12_s1 A1.tif", "dorsal", "red"): (1, 1),
+    ("3556.1 s_1 B2.tif", "roi", "red"): (5, 5),
+    ("3556.1 s_1 B2.tif", "roi", "green"): (2, 1),
+    ("3556.1 s_3.tif", "roi", "red"): (6, 3),
+}
+
+
+def test_parse_names():
+    names = parse_names(["Zymo6 3730.4 1-12_s11.tif", "3556.1 s_1 B2.tif", "Zymo6 3999.2 b.tif",
+                         "Zymo6 3999.2 a.tif", "Zymo6 3730.4 1-12 x.tif"])
+    assert list(names["animal"]) == ["3730.4", "3556.1", "3999.2", "3999.2", "3730.4"]
+    # Names without a section number are numbered in file order, after the parsed sections of their animal
+    assert list(names["section"]) == [11, 1, 1, 2, 12]
+    assert list(names["region"].fillna("")) == ["", "B2", "", "", ""]
+
+
+def test_results_frame():
+    frame = results_frame(COUNTS)
+    assert len(frame) == len(COUNTS)
+    row = frame[(frame["file"] == "Zymo6 3730.4 1-12_s2 A1.tif")].iloc[0]
+    assert (row["animal"], row["section"], row["region"], row["total"], row["ratio"]) == ("3730.4", 2, "A1", 6, 2)
+    assert math.isnan(frame[frame["file"] == "Zymo6 3730.4 1-12_s1 A1.tif"]["ratio"].iloc[0])
+
+
+def test_summaries():
+    frame = results_frame(COUNTS)
+    totals = animal_totals(frame)
+    assert tuple(totals.loc[("3556.1", "roi", "red"), ["sections", "left", "right", "total"]]) == (2, 11, 8, 19)
+    means = region_means(frame)
+    assert tuple(means.loc[("A1", "roi", "red"), ["sections", "left", "right"]]) == (2, 3.5, 1)
+
+
+def test_section_table_does_not_depend_on_file_order():
+    table = section_table(results_frame(COUNTS), "left")
+    reversed_table = section_table(results_frame(dict(reversed(list(COUNTS.items())))), "left")
+    assert table.equals(reversed_table)
+    assert list(table.index) == ["3556.1", "3730.4"]
+    assert list(table.columns) == [(1, "A1"), (1, "B2"), (2, "A1"), (3, "")]
+    assert table.loc["3730.4", (1, "A1")] == 3 and table.loc["3556.1", (3, "")] == 6
+    assert math.isnan(table.loc["3730.4", (3, "")])
+
+
+def test_regions_of_one_section_get_a_column_each():
+    counts = {("3730.4 s_1 A1.tif", "roi", "red"): (3, 1), ("3730.4 s_1 C1.tif", "roi", "red"): (7, 2)}
+    table = section_table(results_frame(counts), "left")
+    assert list(table.columns) == [(1, "A1"), (1, "C1")]
+    assert list(table.loc["3730.4"]) == [3, 7]
+
+
+def test_each_file_is_taken_from_its_main_channel():
+    counts = dict(COUNTS)
+    counts["3556.1 s_2 hyperstack.tif", "roi", "c1"] = (8, 4)
+    counts["3556.1 s_2 hyperstack.tif", "roi", "c2"] = (9, 9)
+    main_channels = {file: "red" for file, _, _ in COUNTS}
+    main_channels["3556.1 s_2 hyperstack.tif"] = "c1"
+    table = section_table(results_frame(counts), "left", channel=main_channels)
+    assert table.loc["3556.1", (2, "")] == 8
+    assert table.loc["3556.1", (1, "B2")] == 5
+    # Taken by name, the hyperstack has no red rows
+    assert (2, "") not in section_table(results_frame(counts), "left").columns
+
+
+def test_files_of_one_section_and_region_are_not_added_up():
+    counts = {("3730.4 s_1 A1.tif", "roi", "red"): (3, 1), ("3730.4 s_01 A1.tif", "roi", "red"): (7, 2)}
+    with pytest.raises(ValueError, match="same animal, section and region"):
+        section_table(results_frame(counts), "left")
+    assert section_table(results_frame(counts), "left", aggfunc="sum").loc["3730.4", (1, "A1")] == 10
+    # The script checks the file names with duplicate_names before anything is counted
+    assert duplicate_names([file for file, _, _ in counts] + ["3730.4 s_1 C1.tif"]) == [["3730.4 s_1 A1.tif",
+                                                                                         "3730.4 s_01 A1.tif"]]
+    assert duplicate_names([file for file, _, _ in COUNTS]) == []
+
+
+def test_write_counts(tmp_path):
+    from cellcount.excel import write_counts
+
+    openpyxl.Workbook().save(str(tmp_path / "input.xlsx"))
+    write_counts(results_frame(COUNTS), str(tmp_path / "input.xlsx"), str(tmp_path / "output.xlsx"))
+
+    workbook = openpyxl.load_workbook(str(tmp_path / "output.xlsx"))
+    sheet = workbook.active
+    assert [sheet.cell(row=2, column=c).value for c in range(2, 6)] == ["1 A1", "1 B2", "2 A1", 3]
+    assert [sheet.cell(row=r, column=1).value for r in (3, 4)] == ["3556.1", "3730.4"]
+    assert [sheet.cell(row=4, column=c).value for c in range(2, 6)] == [3, None, 4, None]
+    assert sheet.cell(row=3 + 35, column=3).value == 5
+    # Highlighted with the colour of the A1 code in the file name, where the animal has that section
+    assert sheet.cell(row=4, column=2).fill.fgColor.indexed == 27
+    assert sheet.cell(row=3, column=2).fill.patternType is None
+    assert {"Per animal", "Per region"} <= set(workbook.sheetnames)
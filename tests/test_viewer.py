@@ -0,0 +1,130 @@
+# Checks of the tiled viewer: segment reads, tiles, rotations and the overview.
+
+import warnings
+
+import cv2
+import numpy as np
+import pytest
+
+from cellcount.images import load_image, rotate_image, to_bgr8
+from cellcount.viewer import TiledImage
+
+tifffile = pytest.importorskip("tifffile")
+
+# Most images here are too small for a pyramid and are opened without a preview
+pytestmark = pytest.mark.filterwarnings("ignore:.*overview is built:UserWarning")
+
+
+@pytest.fixture
+def section():
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, size=(300, 420, 3), dtype=np.uint8)
+    return cv2.GaussianBlur(image, (9, 9), 3)
+
+
+LAYOUTS = {
+    "strips": {"rowsperstrip": 16},
+    "tiles": {"tile": (64, 64), "compression": "zlib"},
+    "big endian": {"byteorder": ">", "rowsperstrip": 7},
+}
+
+
+@pytest.mark.parametrize("layout", LAYOUTS)
+def test_tiles_are_read_from_segments(tmp_path, section, layout):
+    path = str(tmp_path / "section.tif")
+    tifffile.imwrite(path, cv2.cvtColor(section, cv2.COLOR_BGR2RGB), photometric="rgb", **LAYOUTS[layout])
+    tiled = TiledImage(path, tile_size=128, overview_size=100)
+    assert type(tiled._reader).__name__ == "_SegmentReader"
+    assert (tiled.width, tiled.height) == (420, 300)
+    assert (tiled.tile(0, 1, 2) == section[256:300, 128:256]).all()
+    # At one screen pixel per image pixel the view is the image itself
+    assert (tiled.render(50, 40, 1, 200, 100) == section[40:140, 50:250]).all()
+    assert tiled.overview.shape == (300 // 5, 420 // 5, 3)
+    tiled.close()
+
+
+def test_stacks_are_projected(tmp_path):
+    planes = np.random.default_rng(1).integers(0, 65536, size=(3, 100, 120), dtype=np.uint16)
+    path = str(tmp_path / "stack.tif")
+    tifffile.imwrite(path, planes, photometric="minisblack", rowsperstrip=10)
+    tiled = TiledImage(path, tile_size=64)
+    assert (tiled.render(0, 0, 1, 120, 100) == to_bgr8(planes.max(axis=0))).all()
+    tiled.close()
+
+
+def test_other_images_are_decoded(tmp_path, section):
+    path = str(tmp_path / "section.png")
+    cv2.imwrite(path, section)
+    with pytest.warns(UserWarning, match="decodes and holds the whole image"):
+        tiled = TiledImage(path, tile_size=128)
+    assert type(tiled._reader).__name__ == "_DecodedReader"
+    assert (tiled.render(0, 0, 1, 420, 300) == load_image(path)).all()
+    tiled.close()
+
+
+def test_rotated_tiles_match_the_rotated_image(tmp_path, section):
+    path = str(tmp_path / "section.tif")
+    tifffile.imwrite(path, cv2.cvtColor(section, cv2.COLOR_BGR2RGB), photometric="rgb", rowsperstrip=16)
+    tiled = TiledImage(path, rotations=[7, 180], tile_size=128)
+    expected = rotate_image(rotate_image(section, 7), 180)
+    view = tiled.render(0, 0, 1, 420, 300)
+    # One combined warp instead of two, so only interpolation differences, away from the clipped corners
+    difference = np.abs(view.astype(int) - expected.astype(int))[60:-60, 60:-60]
+    assert difference.mean() < 2
+    tiled.close()
+
+
+def test_hyperstacks_and_thumbnails(tmp_path):
+    planes = np.random.default_rng(2).integers(0, 65536, size=(3, 100, 120), dtype=np.uint16)
+    path = str(tmp_path / "stack.tif")
+    with tifffile.TiffWriter(path) as tif:
+        for plane in planes:
+            tif.write(plane, photometric="minisblack")
+        tif.write(planes[0][::2, ::2].copy(), subfiletype=1)
+    tiled = TiledImage(path, tile_size=64)
+    assert type(tiled._reader).__name__ == "_SegmentReader"
+    assert (tiled.render(0, 0, 1, 120, 100) == to_bgr8(planes.max(axis=0))).all()
+    tiled.close()
+
+    path = str(tmp_path / "hyperstack.tif")
+    tifffile.imwrite(path, planes.reshape(3, 1, 100, 120).repeat(2, axis=1), imagej=True, metadata={"axes": "ZCYX"})
+    with pytest.warns(UserWarning, match="decodes"):
+        tiled = TiledImage(path, tile_size=64)
+    assert type(tiled._reader).__name__ == "_DecodedReader"
+    assert (tiled.render(0, 0, 1, 120, 100) == to_bgr8(planes.max(axis=0))).all()
+    tiled.close()
+
+
+def test_overview_comes_from_saved_levels(tmp_path, section):
+    streamed_path, pyramid_path = str(tmp_path / "streamed.tif"), str(tmp_path / "pyramid.tif")
+    section = cv2.resize(section, (1680, 1200))
+    rgb = cv2.cvtColor(section, cv2.COLOR_BGR2RGB)
+    tifffile.imwrite(streamed_path, rgb, photometric="rgb", tile=(256, 256))
+    with tifffile.TiffWriter(pyramid_path) as tif:
+        tif.write(rgb, photometric="rgb", tile=(256, 256), subifds=2)
+        for factor in (2, 4):
+            level = cv2.resize(rgb, (1680 // factor, 1200 // factor), interpolation=cv2.INTER_AREA)
+            tif.write(level, photometric="rgb", tile=(256, 256), subfiletype=1)
+
+    with pytest.warns(UserWarning, match="overview is built"):
+        streamed = TiledImage(streamed_path, overview_size=420)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        saved = TiledImage(pyramid_path, overview_size=420)
+    assert saved.overview.shape == streamed.overview.shape == (300, 420, 3)
+    assert np.abs(saved.overview.astype(int) - streamed.overview.astype(int)).mean() < 1
+    streamed.close()
+    saved.close()
+
+
+def test_overview_comes_from_the_preview(tmp_path, section):
+    path, preview = str(tmp_path / "section.tif"), str(tmp_path / "preview.png")
+    tifffile.imwrite(path, cv2.cvtColor(section, cv2.COLOR_BGR2RGB), photometric="rgb", rowsperstrip=16)
+    cv2.imwrite(preview, cv2.resize(section, (105, 75), interpolation=cv2.INTER_AREA))
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        tiled = TiledImage(path, overview_size=100, preview=preview)
+    assert tiled.overview.shape == (60, 84, 3)
+    expected = cv2.resize(section, (84, 60), interpolation=cv2.INTER_AREA)
+    assert np.abs(tiled.overview.astype(int) - expected.astype(int)).mean() < 3
+    tiled.close()